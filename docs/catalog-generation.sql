@@ -0,0 +1,36 @@
+--
+-- Trigger maintained catalog generation counter.
+--
+-- Any change to the catalog tables increments the counter. Enable with -
+--
+--   CATALOG_GENERATION_QUERY = 'SELECT generation FROM hummaps.catalog_generation'
+--
+
+CREATE TABLE hummaps.catalog_generation (
+    generation bigint NOT NULL
+);
+INSERT INTO hummaps.catalog_generation VALUES (0);
+GRANT SELECT ON hummaps.catalog_generation TO hummaps;
+
+CREATE OR REPLACE FUNCTION hummaps.bump_catalog_generation() RETURNS trigger AS $$
+BEGIN
+    UPDATE hummaps.catalog_generation SET generation = generation + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t text;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[
+        'map', 'maptype', 'map_image', 'pdf', 'scan', 'cc', 'cc_image',
+        'trs_path', 'source', 'surveyor', 'signed_by'
+    ] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS catalog_generation ON hummaps.%I', t);
+        EXECUTE format(
+            'CREATE TRIGGER catalog_generation AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE '
+            'ON hummaps.%I FOR EACH STATEMENT EXECUTE PROCEDURE hummaps.bump_catalog_generation()', t);
+    END LOOP;
+END;
+$$;
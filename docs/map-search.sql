@@ -0,0 +1,40 @@
+--
+-- Flattened search table, one row per map.
+--
+-- Create the table then populate it with 'flask refresh-search-table' and
+-- enable with SEARCH_TABLE = True. Re-run the refresh after catalog updates.
+--
+-- Surveyor names and license numbers are carried as arrays for ad hoc queries.
+-- BY searches resolve matching surveyors first and filter on surveyor_ids so
+-- several BY terms in one search term must still match the same surveyor.
+--
+
+CREATE EXTENSION IF NOT EXISTS ltree;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE hummaps.map_search (
+    id              integer PRIMARY KEY REFERENCES hummaps.map (id) ON DELETE CASCADE,
+    maptype         text,
+    abbrev          text,
+    book            integer,
+    page            integer,
+    npages          integer,
+    recdate         date,
+    client          text,
+    description     text,
+    surveyor_ids    integer[] NOT NULL DEFAULT '{}',
+    fullnames       text[] NOT NULL DEFAULT '{}',
+    pls             text[] NOT NULL DEFAULT '{}',
+    rce             text[] NOT NULL DEFAULT '{}',
+    trs_paths       ltree[] NOT NULL DEFAULT '{}'
+);
+
+CREATE INDEX map_search_trs_paths_idx ON hummaps.map_search USING gist (trs_paths);
+CREATE INDEX map_search_surveyor_ids_idx ON hummaps.map_search USING gin (surveyor_ids);
+CREATE INDEX map_search_client_trgm_idx ON hummaps.map_search USING gin (client gin_trgm_ops);
+CREATE INDEX map_search_description_trgm_idx ON hummaps.map_search USING gin (description gin_trgm_ops);
+CREATE INDEX map_search_map_idx ON hummaps.map_search (abbrev, book, page);
+CREATE INDEX map_search_recdate_idx ON hummaps.map_search (recdate);
+CREATE INDEX map_search_order_idx ON hummaps.map_search (maptype, recdate DESC, book DESC, page DESC);
+
+GRANT SELECT ON hummaps.map_search TO hummaps;
@@ -0,0 +1,19 @@
+--
+-- Trigram indexes for regex searches of map client and description.
+--
+-- With these in place PostgreSQL can answer the ~* predicates used by FOR,
+-- DESC, ANY and bare word searches from the indexes rather than a sequential
+-- scan of the map table. The in-process trigram index can then be disabled -
+--
+--   TRIGRAM_INDEX = False
+--
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS map_client_trgm_idx
+    ON hummaps.map USING gin (client gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS map_description_trgm_idx
+    ON hummaps.map USING gin (description gin_trgm_ops);
+
+ANALYZE hummaps.map;
@@ -1,4 +1,4 @@
-from flask import Flask
+from flask import Flask, request
 import os.path
 
 app = Flask(__name__)
@@ -27,13 +27,110 @@ MAP_URL_BASE = 'hummaps'
 # Location of map images and pdfs.
 MAP_IMAGE_ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../map'))
 MAP_PDF_ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../pdf'))
+SCAN_ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../scan'))
+
+# How map images and pdfs are sent when the front end passes the request to
+# the app, see files.py. 'x-accel' (nginx), 'x-sendfile' or None to send from the app.
+MAP_FILE_DELIVERY = None
+MAP_IMAGE_ACCEL_PREFIX = '/protected/hummaps/map'
+MAP_PDF_ACCEL_PREFIX = '/protected/hummaps/pdf'
+
+# Deep zoom tile pyramids and previews for map images, see tiles.py
+TILE_ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../tiles'))
+TILE_ACCEL_PREFIX = '/protected/hummaps/tiles'
+TILE_SIZE = 256
+TILE_OVERLAP = 1
+TILE_QUALITY = 85
+TILE_PREVIEW_WIDTH = 400
+
+# Web size derivatives of map scans, see derivatives.py.
+# Presets are name (file extension) -> (Pillow format, quality).
+SCAN_DERIVATIVE_WIDTHS = (800, 1600, 3200)
+SCAN_DERIVATIVE_PRESETS = {'jpg': ('JPEG', 80), 'webp': ('WEBP', 75)}
+SCAN_DERIVATIVE_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../derivatives'))
+SCAN_DERIVATIVE_CACHE_SIZE = 2 * 1024 ** 3
+SCAN_DERIVATIVE_ACCEL_PREFIX = '/protected/hummaps/derivatives'
+SCAN_DERIVATIVE_WORKERS = 2
+SCAN_DERIVATIVE_TIMEOUT = 20
+
+# Cached path resolution and file stat for map images and pdfs
+FILE_TABLE_SIZE = 10000
+FILE_TABLE_TTL = 60
+
+# Resolve township/range/section search terms from an in-process index
+# rather than with ltree queries against the trs_path table.
+TRS_INDEX = True
+
+# Prefilter client and description regex searches with an in-process trigram
+# index. Regexes matching more than TRIGRAM_MAX_CANDIDATES maps are not prefiltered.
+TRIGRAM_INDEX = True
+TRIGRAM_MAX_CANDIDATES = 5000
+
+# Resolve BY search terms to surveyor ids from an in-process surveyor list
+# rather than matching surveyor regexes inside the map join.
+SURVEYOR_INDEX = True
+
+# Number of parsed searches held in the parse_search LRU cache
+PARSE_CACHE_SIZE = 1024
+
+# Catalog generation counters, see catalog.py. Set either to None to disable.
+CATALOG_GENERATION_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), '../catalog-generation'))
+CATALOG_GENERATION_QUERY = None
+# CATALOG_GENERATION_QUERY = 'SELECT generation FROM hummaps.catalog_generation'
+
+# Search result cache of ordered map ids keyed by parsed search and catalog generation.
+# SEARCH_RESULT_CACHE can be set to any object with get(key) and set(key, value)
+# methods to replace the default in-process LRU cache.
+SEARCH_RESULT_CACHE = None
+SEARCH_RESULT_CACHE_SIZE = 256
+
+# Search evaluator, 'sql' combines union/except terms with a SQL UNION/EXCEPT
+# query, 'bitset' resolves each term to map ids and combines them in memory.
+SEARCH_EVALUATOR = 'sql'
+
+# Search the flattened map_search table (docs/map-search.sql) rather than
+# joining the catalog tables. Refresh with 'flask refresh-search-table'.
+SEARCH_TABLE = False
+
+# Number of maps on a page of the map list
+SEARCH_PAGE_SIZE = 200
+
+# Structured search log, see searchlog.py. Set SEARCH_LOG_FILE to None to disable.
+SEARCH_LOG_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), '../logs/search.log'))
+SEARCH_LOG_MAX_BYTES = 10 * 1024 ** 2
+SEARCH_LOG_BACKUP_COUNT = 20
+
+# Number of rendered map list rows cached, see rows.py
+MAP_ROW_CACHE_SIZE = 20000
+
+# Fraction of map list requests traced to the 'hummaps.search' logger, see trace.py.
+# SEARCH_TRACE_SERVER_TIMING adds a Server-Timing header to traced responses.
+SEARCH_TRACE_RATE = 0.0
+SEARCH_TRACE_SERVER_TIMING = False
+
+# Maximum number of maps in one page of the JSON search API and the number
+# of maps loaded from the database at a time while streaming a page.
+SEARCH_API_PAGE_SIZE = 10000
+SEARCH_API_CHUNK_SIZE = 500
+
+# Search guardrails, see guard.py. Searches costing SEARCH_EXPENSIVE_COST or
+# more share SEARCH_EXPENSIVE_CONCURRENCY slots per process and give up after
+# waiting SEARCH_QUEUE_TIMEOUT seconds for one. Statement timeouts are in
+# milliseconds, None for no timeout.
+SEARCH_EXPENSIVE_COST = 10
+SEARCH_EXPENSIVE_CONCURRENCY = 1
+SEARCH_QUEUE_TIMEOUT = 2.0
+SEARCH_STATEMENT_TIMEOUT = 5000
+SEARCH_EXPENSIVE_TIMEOUT = 15000
 
 # app.config.from_envvar('FLASKAPP_CONFIG', silent=False)
 app.config.from_object(__name__)
 
 import hummaps.views
+import hummaps.commands
 
 from hummaps.database import db_session
+from hummaps.assets import asset_manifest
 
 @app.before_request
 def before_request():
@@ -42,8 +139,12 @@ def before_request():
 @app.after_request
 def after_request(resp):
     if resp.mimetype == 'text/html':
-        resp.cache_control.no_store = True
+        # pages with an ETag can be stored but must be revalidated
+        if 'ETag' not in resp.headers:
+            resp.cache_control.no_store = True
         resp.cache_control.no_cache = True
+    elif request.endpoint == 'static' and asset_manifest.is_fingerprinted(request.view_args['filename']):
+        resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
     return resp
 
 @app.teardown_request
@@ -0,0 +1,86 @@
+#
+# Streaming JSON search API
+#
+#   GET /hummaps/api/search?q=<search>[&limit=<n>]
+#   GET /hummaps/api/search?cursor=<cursor>
+#
+# Results are streamed as newline delimited JSON, one map per line, followed
+# by a trailer line with the total number of maps and a cursor for the next
+# page or null after the last page. The cursor is signed and opaque to clients.
+# It carries the search, offset, page size and the catalog generation the
+# search ran against. Pages are sliced from the cached ordered map ids for the
+# search so fetching the next page doesn't re-run the search, and maps are
+# loaded from the database in chunks as the response is written.
+#
+
+import json
+from urllib.parse import urljoin
+
+from flask import url_for
+from itsdangerous import URLSafeSerializer, BadSignature
+
+from hummaps import app
+from hummaps.catalog import generation
+from hummaps.search import search_ids, load_maps
+
+
+# A cursor issued before the last catalog update
+class CursorError(Exception):
+    pass
+
+
+def _serializer():
+    return URLSafeSerializer(app.config['SECRET_KEY'], salt='hummaps-search-cursor')
+
+
+def make_cursor(search, offset, limit, gen):
+    return _serializer().dumps({'q': search, 'o': offset, 'n': limit, 'g': gen})
+
+
+# Decode a cursor to (search, offset, limit). Raises ValueError if the cursor
+# is invalid and CursorError if the catalog has changed since it was issued.
+def read_cursor(cursor):
+    try:
+        c = _serializer().loads(cursor)
+    except BadSignature:
+        raise ValueError('Invalid cursor')
+    if c['g'] != generation():
+        raise CursorError('Catalog has changed, restart the search')
+    return c['q'], c['o'], c['n']
+
+
+# Map image and pdf links resolve the same as the links on the map list page,
+# MAP_URL_BASE + url relative to the page url.
+def map_url(page_url, url):
+    return urljoin(page_url, app.config['MAP_URL_BASE'] + url)
+
+
+def map_record(map, page_url):
+    return {
+        'id': map.id,
+        'bookpage': map.bookpage,
+        'heading': map.heading,
+        'line1': map.line1,
+        'line2': map.line2,
+        'line3': map.line3,
+        'line4': map.line4,
+        'images': [map_url(page_url, img.url) for img in map.mapimages],
+        'pdf': map_url(page_url, map.pdf.url) if map.pdf else None,
+    }
+
+
+# Generate NDJSON lines for a page of search results.
+def search_lines(search, offset, limit):
+    gen = generation()
+    ids = search_ids(search)
+    page = ids[offset:offset + limit]
+    page_url = url_for('hummaps', _external=True)
+
+    chunk = app.config['SEARCH_API_CHUNK_SIZE']
+    for i in range(0, len(page), chunk):
+        for map in load_maps(page[i:i + chunk]):
+            yield json.dumps(map_record(map, page_url)) + '\n'
+
+    end = offset + len(page)
+    cursor = make_cursor(search, end, limit, gen) if end < len(ids) else None
+    yield json.dumps({'total': len(ids), 'cursor': cursor}) + '\n'
@@ -0,0 +1,162 @@
+#
+# Fingerprinted static assets
+#
+# 'flask build-assets' writes a minified copy of every js and css file in
+# the static folder named with a hash of its content, next to the original
+# so relative urls in the css still resolve -
+#
+#   js/hummaps-18.3.11.js -> js/hummaps-18.3.11.1a2b3c4d.js (+ .gz, .br)
+#
+# and records the names in static/manifest.json. Templates link assets with
+# asset_url('js/hummaps-18.3.11.js') which resolves through the manifest so a
+# deploy that changes an asset changes its url. Fingerprinted files never
+# change and are served as immutable, nginx serves the precompressed copies
+# (see uwsgi/nginx.conf). Without a manifest asset_url falls back to the
+# original files.
+#
+# Minification uses rjsmin and rcssmin when installed, files that are
+# already minified (*.min.js, *.min.css) are copied as is. Brotli copies are
+# written when the brotli module is installed.
+#
+
+import gzip
+import json
+import os
+import re
+import threading
+from hashlib import sha1
+
+from flask import url_for
+
+from hummaps import app
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+MANIFEST_FILE = 'manifest.json'
+ASSET_TYPES = ('.js', '.css')
+
+# A fingerprinted file name, name.<8 hex digits>.ext
+FINGERPRINT_PAT = re.compile(r'.+\.[0-9a-f]{8}\.(js|css)$')
+
+
+def minify(filename, text):
+    if re.search(r'\.min\.(js|css)$', filename):
+        return text
+    if filename.endswith('.js') and rjsmin is not None:
+        return rjsmin.jsmin(text)
+    if filename.endswith('.css') and rcssmin is not None:
+        return rcssmin.cssmin(text)
+    return text
+
+
+# Optional modules build_assets can't find, assets are still built but
+# aren't minified or don't get brotli copies.
+def missing_modules():
+    modules = (('rjsmin', rjsmin), ('rcssmin', rcssmin), ('brotli', brotli))
+    return [name for name, module in modules if module is None]
+
+
+# Build fingerprinted, compressed assets and the manifest.
+# Returns the manifest, source name -> fingerprinted name.
+def build_assets(static_dir=None):
+    static_dir = static_dir or app.static_folder
+    manifest = {}
+    stale = set()
+
+    for dirpath, dirnames, filenames in os.walk(static_dir):
+        for f in sorted(filenames):
+            path = os.path.join(dirpath, f)
+            if FINGERPRINT_PAT.match(f):
+                stale.add(path)
+                continue
+            if not f.endswith(ASSET_TYPES):
+                continue
+
+            with open(path, 'rb') as fp:
+                data = minify(f, fp.read().decode('utf-8')).encode('utf-8')
+            root, ext = os.path.splitext(path)
+            out = '%s.%s%s' % (root, sha1(data).hexdigest()[:8], ext)
+
+            with open(out, 'wb') as fp:
+                fp.write(data)
+            with open(out + '.gz', 'wb') as fp:
+                fp.write(gzip.compress(data, 9))
+            if brotli is not None:
+                with open(out + '.br', 'wb') as fp:
+                    fp.write(brotli.compress(data))
+
+            stale.discard(out)
+            name = os.path.relpath(path, static_dir).replace(os.sep, '/')
+            manifest[name] = os.path.relpath(out, static_dir).replace(os.sep, '/')
+
+    # remove fingerprinted files from earlier builds
+    for path in stale - set(os.path.join(static_dir, f) for f in manifest.values()):
+        for p in (path, path + '.gz', path + '.br'):
+            if os.path.exists(p):
+                os.remove(p)
+
+    tmp = os.path.join(static_dir, MANIFEST_FILE + '.tmp')
+    with open(tmp, 'w') as fp:
+        json.dump(manifest, fp, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(static_dir, MANIFEST_FILE))
+
+    return manifest
+
+
+class AssetManifest(object):
+
+    def __init__(self):
+        # (mtime, manifest, fingerprinted names)
+        self._data = (None, {}, frozenset())
+        self._lock = threading.Lock()
+
+    # Reload the manifest if it changed since it was last read
+    def _manifest(self):
+        filename = os.path.join(app.static_folder, MANIFEST_FILE)
+        try:
+            mtime = os.stat(filename).st_mtime
+        except OSError:
+            mtime = None
+        data = self._data
+        if data[0] != mtime:
+            with self._lock:
+                manifest = {}
+                if mtime is not None:
+                    with open(filename) as fp:
+                        manifest = json.load(fp)
+                data = self._data = (mtime, manifest, frozenset(manifest.values()))
+        return data
+
+    # Changes whenever the manifest does
+    @property
+    def version(self):
+        return self._manifest()[0]
+
+    def resolve(self, filename):
+        return self._manifest()[1].get(filename, filename)
+
+    def is_fingerprinted(self, filename):
+        return filename in self._manifest()[2]
+
+
+asset_manifest = AssetManifest()
+
+
+# Url of a static asset through the manifest
+@app.template_global()
+def asset_url(filename):
+    return url_for('static', filename=asset_manifest.resolve(filename))
@@ -0,0 +1,66 @@
+#
+# Bitset search evaluation
+#
+# The SQL evaluator builds a subquery with four joins for every union/except
+# term and leaves the set algebra to a UNION/EXCEPT plan. The bitset evaluator
+# resolves each term to a set of map ids (from an index or a single query of
+# ids) and combines the terms as numpy boolean arrays.
+#
+# Bits are indexed by a map's position in the result order (maptype, recdate
+# desc, book desc, page desc) rather than by map id. Combining the terms
+# leaves the bits of the final result already in order, so there's no sort.
+#
+
+import numpy as np
+
+from hummaps.database import db_session
+from hummaps.models import Map, MapType
+
+
+class MapOrder(object):
+
+    def __init__(self):
+        self.ids = None         # map ids in result order
+        self.rank = None        # position in result order by map id, -1 if none
+        self.generation = None
+
+    @property
+    def loaded(self):
+        return self.ids is not None
+
+    def refresh(self, generation=None):
+        q = db_session.query(Map.id).join(MapType)
+        q = q.order_by(MapType.maptype, Map.recdate.desc(), Map.book.desc(), Map.page.desc())
+        ids = np.fromiter((id for id, in q.yield_per(10000)), dtype=np.int32)
+
+        rank = np.full(ids.max() + 1 if len(ids) else 0, -1, dtype=np.int32)
+        rank[ids] = np.arange(len(ids), dtype=np.int32)
+
+        self.ids, self.rank = ids, rank
+        self.generation = generation
+
+    # Rebuild if built for a different catalog generation.
+    def update(self, generation):
+        if self.ids is None or self.generation != generation:
+            self.refresh(generation)
+
+    def empty(self):
+        if self.ids is None:
+            self.refresh()
+        return np.zeros(len(self.ids), dtype=np.bool_)
+
+    # Bitset from an iterable of map ids.
+    def bitset(self, ids):
+        bits = self.empty()
+        ids = np.fromiter(ids, dtype=np.int64)
+        ids = ids[(ids >= 0) & (ids < len(self.rank))]
+        rank = self.rank[ids]
+        bits[rank[rank >= 0]] = True
+        return bits
+
+    # Map ids for a bitset in result order.
+    def ordered(self, bits):
+        return tuple(self.ids[bits].tolist())
+
+
+map_order = MapOrder()
@@ -0,0 +1,75 @@
+#
+# Catalog generation
+#
+# The map catalog changes only when new maps are recorded. Anything derived
+# from it (search results, in-memory indexes) is tagged with the catalog
+# generation and rebuilt when the generation changes.
+#
+# The generation is the sum of two monotonic counters, either of which can
+# be disabled in the configuration -
+#
+#   CATALOG_GENERATION_FILE - a small file holding an integer, bumped by the
+#   'flask refresh-catalog' command after the catalog is updated. Checking it
+#   is a stat() per request.
+#
+#   CATALOG_GENERATION_QUERY - a query returning a counter maintained by
+#   database triggers on the catalog tables (docs/catalog-generation.sql).
+#
+
+import os
+
+from sqlalchemy import text
+
+from hummaps import app
+from hummaps.database import db_session
+
+
+# Last generation read from the generation file keyed by its stat
+_file_generation = (None, 0)
+
+
+def _read_generation_file(filename):
+    global _file_generation
+
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return 0
+
+    key = (st.st_ino, st.st_size, st.st_mtime_ns)
+    if _file_generation[0] != key:
+        with open(filename, 'r') as f:
+            s = f.read().strip()
+        _file_generation = (key, int(s) if s.isdigit() else 0)
+
+    return _file_generation[1]
+
+
+def generation():
+    gen = 0
+
+    filename = app.config['CATALOG_GENERATION_FILE']
+    if filename:
+        gen += _read_generation_file(filename)
+
+    query = app.config['CATALOG_GENERATION_QUERY']
+    if query:
+        gen += db_session.execute(text(query)).scalar() or 0
+
+    return gen
+
+
+# Increment the file generation. The new value is written to a temporary
+# file and renamed into place so readers never see a partial write.
+def bump_generation():
+    filename = app.config['CATALOG_GENERATION_FILE']
+    if not filename:
+        raise ValueError('CATALOG_GENERATION_FILE is not configured')
+
+    gen = _read_generation_file(filename) + 1
+    tmpfile = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmpfile, 'w') as f:
+        f.write('%d\n' % gen)
+    os.replace(tmpfile, filename)
+
+    return gen
@@ -0,0 +1,79 @@
+#
+# Command line tools
+#
+# Run with the flask command -
+#
+#   FLASK_APP=hummaps flask refresh-catalog
+#   FLASK_APP=hummaps flask refresh-search-table
+#   FLASK_APP=hummaps flask build-tiles
+#   FLASK_APP=hummaps flask build-assets
+#   FLASK_APP=hummaps flask search-report
+#
+
+import click
+
+from hummaps import app
+from hummaps.catalog import bump_generation
+from hummaps.searchtable import refresh_search_table
+from hummaps.tiles import build_tiles
+from hummaps.assets import build_assets, missing_modules
+from hummaps.searchlog import log_files, read_records, search_report
+
+
+# Bump the catalog generation after recording new maps. Cached search
+# results and in-memory indexes are rebuilt on their next use.
+@app.cli.command('refresh-catalog')
+def refresh_catalog():
+    gen = bump_generation()
+    click.echo('catalog generation: %d' % gen)
+
+
+# Bring the flattened search table up to date with the catalog. Search results
+# may change so the catalog generation is bumped when any rows were touched.
+@app.cli.command('refresh-search-table')
+def refresh_search():
+    upserted, deleted = refresh_search_table()
+    click.echo('search table: %d rows updated, %d rows deleted' % (upserted, deleted))
+    if upserted or deleted:
+        gen = bump_generation()
+        click.echo('catalog generation: %d' % gen)
+
+
+# Build deep zoom tile pyramids for new and changed map images.
+@app.cli.command('build-tiles')
+@click.option('--workers', type=int, default=None, help='Number of worker processes.')
+@click.option('--force', is_flag=True, help='Rebuild every image.')
+def build_map_tiles(workers, force):
+    built, skipped, errors = build_tiles(workers=workers, force=force, echo=click.echo)
+    click.echo('tiles: %d built, %d unchanged, %d errors' % (built, skipped, len(errors)))
+
+
+# Build fingerprinted, compressed js and css and the asset manifest.
+@app.cli.command('build-assets')
+def build_static_assets():
+    for name in missing_modules():
+        click.echo('warning: %s is not installed, see docs/requirements.txt' % name, err=True)
+    manifest = build_assets()
+    for name in sorted(manifest):
+        click.echo('%s -> %s' % (name, manifest[name]))
+
+
+# Summarize the search log.
+@app.cli.command('search-report')
+@click.option('--top', type=int, default=20, help='Number of searches in each list.')
+@click.argument('files', nargs=-1, type=click.Path(exists=True))
+def search_log_report(top, files):
+    report = search_report(read_records(files or log_files()), top=top)
+    click.echo('%d searches' % report['total'])
+    click.echo('\nTop searches:')
+    for query, n in report['top']:
+        click.echo('%8d  %s' % (n, query))
+    click.echo('\nSlowest searches:')
+    for msec, query, count in report['slowest']:
+        click.echo('%8.1f ms  %s (%d maps)' % (msec, query, count))
+    click.echo('\nSearches with no maps:')
+    for query, n in report['zero']:
+        click.echo('%8d  %s' % (n, query))
+    click.echo('\nErrors:')
+    for error, n in report['errors']:
+        click.echo('%8d  %s' % (n, error))
@@ -0,0 +1,152 @@
+#
+# Web size derivatives of map scans
+#
+#   GET /hummaps/derivative/<width>/<preset>/<path>
+#
+# Scans are far larger than a browser needs. A derivative is the scan at
+# <path> under SCAN_ROOT_DIR scaled to one of SCAN_DERIVATIVE_WIDTHS and saved
+# with one of the SCAN_DERIVATIVE_PRESETS (format and quality). Derivatives are
+# made on demand in a small thread pool and kept in a size bounded disk cache
+# with least recently used eviction. Concurrent requests for the same
+# derivative wait on the one conversion. Requests that wait longer than
+# SCAN_DERIVATIVE_TIMEOUT get a 503 and find the derivative cached on retry.
+#
+# Cache files are named by a hash of the source path, source mtime, width
+# and preset so a rescanned source gets new derivatives and the stale ones
+# age out. File mtimes record use so LRU order survives a restart.
+#
+# Requires Pillow.
+#
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent import futures
+from hashlib import sha1
+
+from werkzeug.security import safe_join
+
+from hummaps import app
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class DiskLRUCache(object):
+
+    def __init__(self, root, maxsize):
+        self.root = root
+        self.maxsize = maxsize
+        self._files = None      # name -> size, least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        os.makedirs(self.root, exist_ok=True)
+        entries = []
+        for f in os.scandir(self.root):
+            if f.is_file() and not f.name.endswith('.tmp'):
+                st = f.stat()
+                entries.append((st.st_mtime, f.name, st.st_size))
+        self._files = OrderedDict((name, size) for mtime, name, size in sorted(entries))
+        self._size = sum(self._files.values())
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    # True if name is cached, marking it most recently used
+    def get(self, name):
+        with self._lock:
+            if self._files is None:
+                self._load()
+            if name not in self._files:
+                return False
+            self._files.move_to_end(name)
+        try:
+            os.utime(self.path(name))
+        except OSError:
+            with self._lock:
+                self._size -= self._files.pop(name, 0)
+            return False
+        return True
+
+    # Add a file already written to the cache directory and evict old files
+    def add(self, name):
+        size = os.path.getsize(self.path(name))
+        with self._lock:
+            if self._files is None:
+                self._load()
+            self._size += size - self._files.pop(name, 0)
+            self._files[name] = size
+            while self._size > self.maxsize and len(self._files) > 1:
+                old, old_size = self._files.popitem(last=False)
+                self._size -= old_size
+                try:
+                    os.remove(self.path(old))
+                except OSError:
+                    pass
+
+
+class ScanDerivatives(object):
+
+    def __init__(self):
+        self.cache = DiskLRUCache(
+            app.config['SCAN_DERIVATIVE_CACHE_DIR'], app.config['SCAN_DERIVATIVE_CACHE_SIZE'])
+        self._pool = None
+        self._pending = {}      # name -> future
+        self._lock = threading.Lock()
+
+    # Cache file name of a derivative, making it if needed. Raises ValueError
+    # for an unknown width or preset, OSError if the scan doesn't exist and
+    # futures.TimeoutError if the derivative isn't ready in time.
+    def derivative(self, path, width, preset):
+        if Image is None:
+            raise RuntimeError('Pillow is required for scan derivatives')
+        if width not in app.config['SCAN_DERIVATIVE_WIDTHS']:
+            raise ValueError('Bad derivative width: %d' % width)
+        if preset not in app.config['SCAN_DERIVATIVE_PRESETS']:
+            raise ValueError('Bad derivative preset: %s' % preset)
+        src = safe_join(app.config['SCAN_ROOT_DIR'], path)
+        if src is None or not os.path.isfile(src):
+            raise FileNotFoundError(path)
+
+        key = '%s:%s:%d:%s' % (src, os.stat(src).st_mtime, width, preset)
+        name = sha1(key.encode('utf-8')).hexdigest() + '.' + preset
+        if self.cache.get(name):
+            return name
+
+        with self._lock:
+            future = self._pending.get(name)
+            if future is None:
+                if self._pool is None:
+                    self._pool = futures.ThreadPoolExecutor(app.config['SCAN_DERIVATIVE_WORKERS'])
+                future = self._pool.submit(self._make, src, name, width, preset)
+                self._pending[name] = future
+                future.add_done_callback(lambda f: self._done(name))
+
+        future.result(timeout=app.config['SCAN_DERIVATIVE_TIMEOUT'])
+        return name
+
+    def _done(self, name):
+        with self._lock:
+            self._pending.pop(name, None)
+
+    def _make(self, src, name, width, preset):
+        fmt, quality = app.config['SCAN_DERIVATIVE_PRESETS'][preset]
+        Image.MAX_IMAGE_PIXELS = None
+        with Image.open(src) as img:
+            # let the jpeg decoder scale down while decoding
+            img.draft('RGB', (width, width * img.height // img.width))
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            if img.width > width:
+                img = img.resize((width, max(img.height * width // img.width, 1)), Image.LANCZOS)
+            tmp = self.cache.path(name + '.tmp')
+            img.save(tmp, fmt, quality=quality)
+        os.replace(tmp, self.cache.path(name))
+        self.cache.add(name)
+
+
+scan_derivatives = ScanDerivatives()
@@ -0,0 +1,116 @@
+#
+# Map image and pdf file delivery
+#
+# Ideally nginx serves /hummaps/map and /hummaps/pdf directly. When requests
+# do get here MAP_FILE_DELIVERY selects how the file is sent -
+#
+#   'x-accel'       empty response with an X-Accel-Redirect to an internal
+#                   nginx location (see uwsgi/nginx.conf)
+#   'x-sendfile'    empty response with the file path in an X-Sendfile header
+#                   (apache mod_xsendfile, lighttpd)
+#   None            the app sends the file itself
+#
+# In every mode paths are resolved and stat'ed through a small cache so
+# repeat requests don't touch the file system until FILE_TABLE_TTL expires.
+# When the app sends the file, whole files go through the server's
+# wsgi.file_wrapper (sendfile under uwsgi, see offload-threads in uwsgi.ini),
+# byte ranges and conditional requests are answered without reading more of
+# the file than needed.
+#
+
+import mimetypes
+import os
+from collections import namedtuple
+from datetime import datetime
+from time import monotonic
+from zlib import adler32
+
+from flask import request, Response, abort
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+from hummaps import app
+from hummaps.cache import LRUCache
+
+
+FileInfo = namedtuple('FileInfo', ['filename', 'size', 'mtime', 'etag', 'mimetype'])
+
+
+class FileTable(object):
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.ttl = ttl
+        self._cache = LRUCache(maxsize)
+
+    # FileInfo for a path under root or None if it's not a file.
+    def lookup(self, root, path):
+        key = (root, path)
+        now = monotonic()
+        entry = self._cache.get(key)
+        if entry is None or entry[0] < now:
+            entry = (now + self.ttl, self._stat(root, path))
+            self._cache.set(key, entry)
+        return entry[1]
+
+    def _stat(self, root, path):
+        filename = safe_join(root, path)
+        if filename is None:
+            return None
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        if not os.path.isfile(filename):
+            return None
+        etag = '%s-%s-%s' % (
+            st.st_mtime, st.st_size, adler32(filename.encode('utf-8')) & 0xffffffff)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        mtime = datetime.utcfromtimestamp(int(st.st_mtime))
+        return FileInfo(filename, st.st_size, mtime, etag, mimetype)
+
+    def clear(self):
+        self._cache.clear()
+
+
+file_table = FileTable(app.config['FILE_TABLE_SIZE'], app.config['FILE_TABLE_TTL'])
+
+
+# Response for a file under root. accel_prefix is the internal nginx
+# location mapped to root for X-Accel-Redirect delivery.
+def send_map_file(root, path, accel_prefix):
+    info = file_table.lookup(root, path)
+    if info is None:
+        abort(404)
+
+    mode = app.config['MAP_FILE_DELIVERY']
+    if mode == 'x-accel':
+        resp = Response(mimetype=info.mimetype)
+        resp.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + path
+        return resp
+    elif mode == 'x-sendfile':
+        resp = Response(mimetype=info.mimetype)
+        resp.headers['X-Sendfile'] = info.filename
+        return resp
+
+    resp = Response(mimetype=info.mimetype, direct_passthrough=True)
+    resp.set_etag(info.etag)
+    resp.last_modified = info.mtime
+    resp.cache_control.public = True
+    resp.cache_control.max_age = app.get_send_file_max_age(info.filename)
+    resp.accept_ranges = 'bytes'
+
+    # answer conditional requests without opening the file
+    if not is_resource_modified(request.environ, info.etag, last_modified=info.mtime):
+        resp.status_code = 304
+        return resp
+
+    try:
+        f = open(info.filename, 'rb')
+    except OSError:
+        file_table.clear()
+        abort(404)
+    resp.response = wrap_file(request.environ, f)
+    resp.content_length = info.size
+
+    return resp.make_conditional(request, accept_ranges=True, complete_length=info.size)
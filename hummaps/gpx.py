@@ -81,7 +81,9 @@
 import xml.etree.ElementTree as etree
 import xml.dom.minidom as minidom
 from datetime import datetime, timedelta
+import os
 from os import path
+import threading
 import pytz
 import re
 
@@ -91,6 +93,8 @@ from math import sin, cos, atan, atan2, floor
 
 from pyproj import CRS, Transformer
 
+from hummaps.cache import LRUCache
+
 # NAD83 ellipsoid (meters)
 A_GRS80 = 6378137.0
 F_GRS80 = 1 / 298.257222101
@@ -108,6 +112,9 @@ SRID_WGS84 = 4326
 
 WPT_SYMBOL = 'Flag, Red'
 
+# Number of coordinate transforms kept by get_transformer in each thread
+TRANSFORMER_CACHE_SIZE = 16
+
 # Time-dependent Helmert 7-parameter transform (coordinate frame rotation)
 #
 # translations - tx, ty, tz (m)
@@ -146,6 +153,9 @@ HTDP_SITE_NAME = '2020.00'
 DISP_GRID_FILE = 'data/disp-grid-nad83.npy'
 DISP_DIMS_FILE = 'data/disp-grid-nad83.dim'
 
+# Points named in the out of grid warning
+GRID_WARNING_POINTS = 10
+
 
 # Convert HTDP displacements to a numpy grid of signed 32-bit integers.
 # The grid is saved as a .npy file. An associated dims file is created
@@ -232,12 +242,12 @@ def make_disp_grid():
     return
 
 
-# Load the displacement grid and dim file
-def load_disp_grid():
-    grid_file = path.join(path.dirname(__file__), DISP_GRID_FILE)
-    dims_file = path.join(path.dirname(__file__), DISP_DIMS_FILE)
+# Read the displacement grid and dim file. The grid is memory mapped read
+# only so pages are shared through the OS page cache by every process that
+# opens it and only the cells actually used are read from disk.
+def read_disp_grid(grid_file, dims_file):
 
-    grid = np.load(grid_file)
+    grid = np.load(grid_file, mmap_mode='r')
 
     dims = []
     with open(dims_file, 'r') as f:
@@ -251,6 +261,35 @@ def load_disp_grid():
     return grid, (base_lon, base_lat, step_lon, step_lat, epoch_src, epoch_dst)
 
 
+# Process wide displacement grid, reopened when the grid or dim file changes
+class DispGridCache(object):
+
+    def __init__(self):
+        # (mtimes, grid, dims)
+        self._data = (None, None, None)
+        self._lock = threading.Lock()
+
+    def get(self):
+        grid_file = path.join(path.dirname(__file__), DISP_GRID_FILE)
+        dims_file = path.join(path.dirname(__file__), DISP_DIMS_FILE)
+        mtimes = (os.stat(grid_file).st_mtime, os.stat(dims_file).st_mtime)
+        data = self._data
+        if data[0] != mtimes:
+            with self._lock:
+                data = self._data
+                if data[0] != mtimes:
+                    data = self._data = (mtimes,) + read_disp_grid(grid_file, dims_file)
+        return data[1], data[2]
+
+
+disp_grid_cache = DispGridCache()
+
+
+# Load the displacement grid and dim file
+def load_disp_grid():
+    return disp_grid_cache.get()
+
+
 # Get a enu displacement (meters) for a point using 2d linear interpolation.
 def get_disp(P, grid, dims, epoch):
     lon, lat, h = P
@@ -323,7 +362,9 @@ def add_enu_disp(P, D):
     return (lon, lat, h)
 
 
-def itrf_to_nad(P, grid, dims, epoch, inverse=False):
+# Helmert transform ITRF08 -> NAD83 at epoch as a rotation matrix,
+# translation vector and scale factor
+def helmert_params(epoch):
 
     tx, ty, tz, rx, ry, rz, s = ITRF08_NAD83_2010[0:7]
     dtx, dty, dtz, drx, dry, drz, ds, t0 = ITRF08_NAD83_2010[7:]
@@ -348,14 +389,19 @@ def itrf_to_nad(P, grid, dims, epoch, inverse=False):
         (+ry, -rx, 1.0)
     ), dtype=np.double)
 
-    # print(R)
-
     # Translation vector
     T = np.array((tx, ty, tz), dtype=np.double)
 
     # Scale factor
     M = 1.0 + s
 
+    return R, T, M
+
+
+def itrf_to_nad(P, grid, dims, epoch, inverse=False):
+
+    R, T, M = helmert_params(epoch)
+
     # NAD83 HTDP displacement
     if grid is None:
         D = (0.0, 0.0, 0.0)
@@ -432,38 +478,233 @@ def cart_to_ellip(V, grs80=False):
     return (lon, lat, h)
 
 
+#
+# Array versions of the transforms above. Points are (N, 3) arrays of
+# lon/lat/h (decimal degrees, meters) or ECEF x/y/z, one point per row.
+#
+
+# Convert geographic coordinates to ECEF cartesian coordinates
+def ellip_to_cart_array(P, grs80=False):
+    lon, lat, h = np.radians(P[:, 0]), np.radians(P[:, 1]), P[:, 2]
+    a, e2 = (A_GRS80, E2_GRS80) if grs80 else (A_WGS84, E2_WGS84)
+
+    sp = np.sin(lat)
+    n = a / np.sqrt(1 - e2 * sp ** 2)
+    V = np.empty(P.shape, dtype=np.double)
+    V[:, 0] = (n + h) * np.cos(lat) * np.cos(lon)
+    V[:, 1] = (n + h) * np.cos(lat) * np.sin(lon)
+    V[:, 2] = (n * (1 - e2) + h) * sp
+
+    return V
+
+
+# Convert ECEF cartesian coordinates to geographic coordinates
+#
+# Closed form solution by H. Vermeille, Direct transformation from
+# geocentric coordinates to geodetic coordinates, Journal of Geodesy (2002)
+# 76: 451-454. The solution is exact for points outside the evolute of the
+# ellipsoid, a region within about 43 km of the earth's center, so results
+# are limited only by floating point rounding, better than 1e-11 degrees and
+# 1e-8 meters anywhere near the surface of either ellipsoid.
+def cart_to_ellip_array(V, grs80=False):
+    x, y, z = V[:, 0], V[:, 1], V[:, 2]
+    a, e2 = (A_GRS80, E2_GRS80) if grs80 else (A_WGS84, E2_WGS84)
+    e4 = e2 ** 2
+
+    d2 = x ** 2 + y ** 2
+    p = d2 / a ** 2
+    q = (1 - e2) / a ** 2 * z ** 2
+    r = (p + q - e4) / 6
+    s = e4 * p * q / (4 * r ** 3)
+    t = np.cbrt(1 + s + np.sqrt(s * (2 + s)))
+    u = r * (1 + t + 1 / t)
+    v = np.sqrt(u ** 2 + e4 * q)
+    w = e2 * (u + v - q) / (2 * v)
+    k = np.sqrt(u + v + w ** 2) - w
+    d = k * np.sqrt(d2) / (k + e2)
+    dz = np.hypot(d, z)
+
+    lon = np.arctan2(y, x)
+    lat = 2 * np.arctan2(z, d + dz)
+    h = (k + e2 - 1) / k * dz
+
+    return np.column_stack((np.degrees(lon), np.degrees(lat), h))
+
+
+# East/north/up displacements (meters) for points using 2d linear interpolation.
+# Returns an (N, 3) array of displacements and a mask of the points outside
+# the grid, which get a zero displacement.
+def get_disp_array(P, grid, dims, epoch):
+    lon, lat = P[:, 0], P[:, 1]
+
+    base_lon, base_lat = dims[0:2]
+    step_lon, step_lat = dims[2:4]
+    epoch_src, epoch_dst = dims[4:6]
+    dim_i, dim_j = grid.shape[0:2]
+
+    # Indices of lower-right corners of grid cells and fractional positions
+    i = (lon - base_lon) * 3600 / step_lon * -1
+    j = (lat - base_lat) * 3600 / step_lat
+    frac_lon = (i % 1)[:, np.newaxis]
+    frac_lat = (j % 1)[:, np.newaxis]
+
+    # Points with a corner out of range (or a nan coordinate) are masked
+    # and looked up in cell 0, 0
+    with np.errstate(invalid='ignore'):
+        i = np.floor(i)
+        j = np.floor(j)
+        outside = ~((i >= 0) & (i + 1 < dim_i) & (j >= 0) & (j + 1 < dim_j))
+    i = np.where(outside, 0, i).astype(np.intp)
+    j = np.where(outside, 0, j).astype(np.intp)
+
+    LR = grid[i, j].astype(np.double)
+    LL = grid[i + 1, j].astype(np.double)
+    UR = grid[i, j + 1].astype(np.double)
+    UL = grid[i + 1, j + 1].astype(np.double)
+
+    # 2D linear interpolation.
+    D = (1 - frac_lat) * ((1 - frac_lon) * LR + frac_lon * LL)
+    D += frac_lat * ((1 - frac_lon) * UR + frac_lon * UL)
+
+    # Adjust displacement to target epoch and convert to meters
+    D *= (epoch - epoch_src) / (epoch_dst - epoch_src) * 1E-3
+    D[outside] = 0.0
+
+    return np.column_stack((D, np.zeros(len(P)))), outside
+
+
+# Add easting/northing/up displacements to points
+def add_enu_disp_array(P, D):
+    lon, lat = np.radians(P[:, 0]), np.radians(P[:, 1])
+
+    # V1 = R.T * Vd + V0, see add_enu_disp. The rows of R are the
+    # east, north and up unit vectors at each point.
+    sl, sp = np.sin(lon), np.sin(lat)
+    cl, cp = np.cos(lon), np.cos(lat)
+    E = np.column_stack((-sl, +cl, np.zeros(len(P))))
+    N = np.column_stack((-sp * cl, -sp * sl, +cp))
+    U = np.column_stack((+cp * cl, +cp * sl, +sp))
+
+    V1 = ellip_to_cart_array(P) + D[:, 0:1] * E + D[:, 1:2] * N + D[:, 2:3] * U
+
+    return cart_to_ellip_array(V1)
+
+
+# Transform an (N, 3) array of lon/lat/h points, see itrf_to_nad. Returns
+# the transformed points and a mask of points outside the displacement grid.
+def itrf_to_nad_array(P, grid, dims, epoch, inverse=False):
+    P = np.asarray(P, dtype=np.double).reshape((-1, 3))
+
+    R, T, M = helmert_params(epoch)
+
+    # NAD83 HTDP displacement
+    if grid is None:
+        D, outside = np.zeros(P.shape), np.zeros(len(P), dtype=bool)
+    else:
+        D, outside = get_disp_array(P, grid, dims, epoch)
+
+    # Row vectors so V.dot(R.T) rotates each point by R
+    if inverse:
+        P = add_enu_disp_array(P, D)
+        Vs = ellip_to_cart_array(P, grs80=True)
+        Vt = (Vs - T).dot(R) / M
+        return cart_to_ellip_array(Vt, grs80=False), outside
+
+    else:
+        Vs = ellip_to_cart_array(P, grs80=False)
+        Vt = M * Vs.dot(R.T) + T
+        P = cart_to_ellip_array(Vt, grs80=True)
+        return add_enu_disp_array(P, -D), outside
+
+
+# Coordinate transforms and elevation unit conversion factors by source and
+# target srid. Building a transformer looks up both CRSs in the PROJ
+# database so they are built once and reused. Transformers from pyproj
+# before 3.1 (see docs/requirements.txt) aren't safe to share between
+# threads so each uwsgi thread keeps its own cache.
+_transformers = threading.local()
+
+
+def transformer_cache():
+    cache = getattr(_transformers, 'cache', None)
+    if cache is None:
+        cache = _transformers.cache = LRUCache(maxsize=TRANSFORMER_CACHE_SIZE)
+    return cache
+
+
+# Transformer from srid_source to srid_target and the unit conversion factor
+# of the projected system
+def get_transformer(srid_source, srid_target):
+    key = '%d:%d' % (srid_source, srid_target)
+    cache = transformer_cache()
+    xf = cache.get(key)
+    if xf is None:
+        sr_source = CRS.from_epsg(srid_source)
+        sr_target = CRS.from_epsg(srid_target)
+        sr_proj = sr_target if srid_source == SRID_WGS84 else sr_source
+        unit_cf = sr_proj.coordinate_system.axis_list[0].unit_conversion_factor
+        xf = (Transformer.from_crs(sr_source, sr_target, always_xy=True), unit_cf)
+        cache.set(key, xf)
+    return xf
+
+
 # Convert points in place from projected to WGS 84 geographic coordinates
 def proj_to_ellip(pnts, srid_source):
-
-    # Spatial reference systems and coordinate transform
-    sr_source = CRS.from_epsg(srid_source)
-    sr_target = CRS.from_epsg(SRID_WGS84)
-    xf = Transformer.from_crs(sr_source, sr_target, always_xy=True)
+    if not pnts:
+        return
+    xf, unit_cf = get_transformer(srid_source, SRID_WGS84)
 
     # Convert to geographic coordinates, elevations to meters
-    unit_cf = sr_source.coordinate_system.axis_list[0].unit_conversion_factor
-    for p in pnts:
-        x, y, ele = p[0:3]
-        ele *= unit_cf
-        lon, lat = xf.transform(x, y)
-        p[0:3] = (lon, lat, ele)
+    P = np.array([p[0:3] for p in pnts], dtype=np.double)
+    P[:, 0], P[:, 1] = xf.transform(P[:, 0], P[:, 1])
+    P[:, 2] *= unit_cf
+    for p, lon_lat_ele in zip(pnts, P.tolist()):
+        p[0:3] = lon_lat_ele
 
 
 # Convert points in place from WGS 84 geographic to projected coordinates
 def ellip_to_proj(pnts, srid_target):
-
-    # Spatial reference systems and coordinate transform
-    sr_source = CRS.from_epsg(SRID_WGS84)
-    sr_target = CRS.from_epsg(srid_target)
-    xf = Transformer.from_crs(sr_source, sr_target, always_xy=True)
+    if not pnts:
+        return
+    xf, unit_cf = get_transformer(SRID_WGS84, srid_target)
 
     # Convert to projected coordinates, elevations to target units
-    unit_cf = sr_target.coordinate_system.axis_list[0].unit_conversion_factor
-    for p in pnts:
-        lon, lat, ele = p[0:3]
-        ele /= unit_cf
-        x, y = xf.transform(lon, lat)
-        p[0:3] = (x, y, ele)
+    P = np.array([p[0:3] for p in pnts], dtype=np.double)
+    P[:, 0], P[:, 1] = xf.transform(P[:, 0], P[:, 1])
+    P[:, 2] /= unit_cf
+    for p, x_y_ele in zip(pnts, P.tolist()):
+        p[0:3] = x_y_ele
+
+
+# Transform points in place between ITRF08 2019.50 and NAD83 2010.00 in one
+# pass. Points outside the displacement grid can't be transformed, returns
+# the transformed points and the points outside the grid.
+def nad83_transform(pts, inverse=False):
+    if not pts:
+        return pts, []
+    grid, dims = load_disp_grid()
+
+    P = np.array([(pt[0], pt[1], 0.0) for pt in pts], dtype=np.double)
+    P, outside = itrf_to_nad_array(P, grid, dims, epoch=2019.50, inverse=inverse)
+
+    kept, skipped = [], []
+    for pt, (lon, lat, h), out in zip(pts, P.tolist(), outside.tolist()):
+        if out:
+            skipped.append(pt)
+        else:
+            pt[0:2] = (lon, lat)
+            kept.append(pt)
+
+    return kept, skipped
+
+
+# One line report of points skipped by nad83_transform. The report goes in
+# a response header so only the first few points are listed by name.
+def grid_limits_warning(skipped, limit=GRID_WARNING_POINTS):
+    names = ', '.join('%s (lat=%.8f lon=%.8f)' % ((p[4] or '?')[:20], p[1], p[0]) for p in skipped[:limit])
+    more = ' and %d more' % (len(skipped) - limit) if len(skipped) > limit else ''
+    return '%d point%s outside HTDP grid limits not converted: %s%s' % (
+        len(skipped), '' if len(skipped) == 1 else 's', names, more)
 
 
 def pnts_sort_key(p):
@@ -478,15 +719,15 @@ def pnezd_out(pts, srid_target):
     # Convert points to the target projected coordinate system
     ellip_to_proj(pts, srid_target)
 
-    pnezd = ''
+    pnezd = []
     for p in sorted(pts, key=pnts_sort_key):
         # x, y, ele, time, name, cmt, desc, sym, type, samples
         x, y, ele = p[0:3]
         name = '%d' % int(p[4]) if p[4] and p[4].isdigit() else ''
         desc = p[5] or p[6] or ''
-        pnezd += '%s,%.4f,%.4f,%.4f,%s\n' % (name, y, x, ele, desc)
+        pnezd.append('%s,%.4f,%.4f,%.4f,%s\n' % (name, y, x, ele, desc))
 
-    return pnezd
+    return ''.join(pnezd)
 
 
 def pnezd_in(f, srid_source):
@@ -518,7 +759,10 @@ def pnezd_in(f, srid_source):
 #
 # [lon, lat, ele, time, name, cmt, desc, sym, type, samples]
 #
-def gpx_in(f, nad83=False):
+# With nad83 points outside the displacement grid are left out and added
+# to the skipped list if one is given.
+#
+def gpx_in(f, nad83=False, skipped=None):
 
     ns = {
         'gpx': 'http://www.topografix.com/GPX/1/1',
@@ -551,19 +795,19 @@ def gpx_in(f, nad83=False):
         pts.append(pt)
 
     if nad83:
-        grid, dims = load_disp_grid()
-
-        for pt in pts:
-            lon, lat = pt[0:2]
-            P = itrf_to_nad((lon, lat, 0.0), grid, dims, epoch=2019.50, inverse=False)
-            pt[0:2] = P[0:2]
+        pts, outside = nad83_transform(pts, inverse=False)
+        if skipped is not None:
+            skipped.extend(outside)
 
     return pts
 
 
-def gpx_out(pts, nad83=False):
+def gpx_out(pts, nad83=False, skipped=None):
     """ Format a list of points as a GPX file.
 
+    With nad83 points outside the displacement grid are left out and
+    added to the skipped list if one is given.
+
     GPX format for waypoints and routes -
 
     <?xml version="1.0" encoding="utf-8" standalone="no"?>
@@ -622,12 +866,9 @@ def gpx_out(pts, nad83=False):
     etree.SubElement(meta, 'time').text = isotime
 
     if nad83:
-        grid, grid_dims = load_disp_grid()
-
-        for pt in pts:
-            lon, lat = pt[0:2]
-            P = itrf_to_nad((lon, lat, 0.0), grid, grid_dims, epoch=2019.50, inverse=True)
-            pt[0:2] = P[0:2]
+        pts, outside = nad83_transform(pts, inverse=True)
+        if skipped is not None:
+            skipped.extend(outside)
 
     for pt in sorted(pts, key=pnts_sort_key):
         # lon, lat, ele, time, name, cmt, desc, sym, type, samples
@@ -683,6 +924,27 @@ if __name__ == '__main__':
     # make_disp_grid()
     # exit(0)
 
+    # Closed form cart_to_ellip_array against the iterative cart_to_ellip
+    from timeit import default_timer as timer
+
+    n = 20000
+    rng = np.random.default_rng(0)
+    P = np.column_stack((
+        rng.uniform(-125.0, -119.0, n), rng.uniform(38.0, 45.0, n), rng.uniform(-100.0, 4500.0, n)
+    ))
+    for grs80 in (False, True):
+        V = ellip_to_cart_array(P, grs80=grs80)
+        t = timer()
+        Q1 = np.array([cart_to_ellip(v, grs80=grs80) for v in V])
+        t1 = timer() - t
+        t = timer()
+        Q2 = cart_to_ellip_array(V, grs80=grs80)
+        t2 = timer() - t
+        print('%s %d points: iterative %.1f ms, closed form %.1f ms' % (
+            'GRS80' if grs80 else 'WGS84', n, t1 * 1000, t2 * 1000))
+        print('  max difference: lat %.2e deg, h %.2e m' % (
+            np.abs(Q1[:, 1] - Q2[:, 1]).max(), np.abs(Q1[:, 2] - Q2[:, 2]).max()))
+
     # 40 16 11.614692
     # 124 03 23.97228
 
@@ -703,9 +965,7 @@ if __name__ == '__main__':
     print('   %.8f    %.8f' % (P[0], P[1]))
     pts.append(P)
 
-    sr_source = CRS.from_epsg(SRID_WGS84)
-    sr_target = CRS.from_epsg(2225)
-    xf = Transformer.from_crs(sr_source, sr_target, always_xy=True)
+    xf, unit_cf = get_transformer(SRID_WGS84, 2225)
 
     print()
     for P in pts:
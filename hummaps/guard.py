@@ -0,0 +1,120 @@
+#
+# Guardrails for expensive searches
+#
+# User regexes go straight to Postgres ~* and a search like 'desc:.' or
+# 'any=.*' scans and matches every map. Before a search runs we estimate its
+# cost from the parsed terms -
+#
+#   a MAP or ID subterm, or a TRS subterm resolved by the TRS index: 1
+#   a FOR, DESC, ANY, PM or TR regex with a literal long enough for the
+#   trigram prefilter: 2, any other regex: SEARCH_EXPENSIVE_COST
+#   a BY, TYPE or DATE subterm or a TRS subterm matched in SQL: 2
+#
+# MAP, PM and TR subterms are ORed with the rest of their term (see
+# _term_ids), which is ANDed. Index lookups and literal anchored regexes
+# (the subterms above costing less than SEARCH_EXPENSIVE_COST other than
+# BY, TYPE, DATE and SQL TRS) are anchors that narrow the ANDed subterms to
+# a few maps, so the ANDed subterms cost the least of their anchors or, with
+# no anchor, the most of any of them. A BY, TYPE or DATE pattern like
+# 'type:.' can match every map and doesn't make an expensive regex in the
+# same term any cheaper. A term
+# costs the sum of its ORed subterms plus its ANDed subterms and a search
+# costs the sum of its terms. Searches at or over SEARCH_EXPENSIVE_COST
+# share SEARCH_EXPENSIVE_CONCURRENCY slots and wait at most
+# SEARCH_QUEUE_TIMEOUT seconds for one, so cheap searches keep flowing while
+# a heavy one runs. Every search runs under a Postgres statement_timeout, a
+# longer one for expensive searches.
+#
+
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from hummaps import app
+from hummaps.database import db_session
+from hummaps.trigram import required_literals
+
+
+class SearchRejected(Exception):
+    pass
+
+
+# Subterm keys ORed with the rest of the term
+OR_KEYS = ('MAP', 'PM', 'TR')
+
+# Subterm keys matched against small tables or indexed columns
+NARROW_KEYS = ('BY', 'TYPE', 'DATE')
+
+
+def _regex_cost(pattern):
+    expensive = app.config['SEARCH_EXPENSIVE_COST']
+    literals = required_literals(pattern)
+    if literals and max(len(s) for s in literals) >= 3:
+        return 2
+    return expensive
+
+
+# Cost of a subterm and whether it anchors the rest of the term
+def _subterm_cost(k, v):
+    expensive = app.config['SEARCH_EXPENSIVE_COST']
+    if k == 'MAP' or k == 'ID':
+        return 1, True
+    elif k == 'TRS':
+        return (1, True) if app.config['TRS_INDEX'] else (2, False)
+    elif k in NARROW_KEYS:
+        return 2, False
+    elif k == 'PM' or k == 'TR':
+        # a regex on the client anchored by the literal '(PM 123)'
+        cost = _regex_cost(r'\(%s\)' % v)
+    else:
+        cost = _regex_cost(v)
+    return cost, cost < expensive
+
+
+def term_cost(term):
+    or_costs = [_subterm_cost(k, v)[0] for k, v in term if k in OR_KEYS]
+    and_costs = [_subterm_cost(k, v) for k, v in term if k not in OR_KEYS]
+    cost = sum(or_costs)
+    if and_costs:
+        anchors = [c for c, anchor in and_costs if anchor]
+        cost += min(anchors) if anchors else max(c for c, anchor in and_costs)
+    return cost
+
+
+def search_cost(terms):
+    terms_union, terms_except = terms
+    return sum(term_cost(t) for t in terms_union + terms_except)
+
+
+_slots = threading.BoundedSemaphore(app.config['SEARCH_EXPENSIVE_CONCURRENCY'])
+
+
+# Run a search evaluation under the cost limits. Raises SearchRejected if an
+# expensive search can't get a slot in time or runs past its statement timeout.
+@contextmanager
+def admit(terms):
+    expensive = search_cost(terms) >= app.config['SEARCH_EXPENSIVE_COST']
+    if expensive:
+        if not _slots.acquire(timeout=app.config['SEARCH_QUEUE_TIMEOUT']):
+            raise SearchRejected('The server is busy with other broad searches, try again shortly '
+                                 'or narrow the search with a township/range or map number')
+        timeout = app.config['SEARCH_EXPENSIVE_TIMEOUT']
+    else:
+        timeout = app.config['SEARCH_STATEMENT_TIMEOUT']
+
+    try:
+        if timeout and db_session.bind.dialect.name == 'postgresql':
+            # applies to the rest of the request's transaction
+            db_session.execute(text('SET LOCAL statement_timeout = %d' % timeout))
+        yield
+    except OperationalError as e:
+        if 'statement timeout' not in str(e.orig):
+            raise
+        db_session.rollback()
+        raise SearchRejected('Search took too long, narrow the search with a township/range, '
+                             'map number or a longer pattern')
+    finally:
+        if expensive:
+            _slots.release()
@@ -1,5 +1,6 @@
 from sqlalchemy.orm import relationship
 from sqlalchemy import Table, Column, Integer, String, Date, ForeignKey
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy_utils import LtreeType
 from sqlalchemy.ext.hybrid import hybrid_property, hybrid_method
 
@@ -258,6 +259,31 @@ class Map(Base):
         return '<Map(id=%d, map="%s")>' % (self.id, self.bookpage)
 
 
+# Denormalized search relation with one row per map (see searchtable.py)
+class MapSearch(Base):
+    __tablename__ = 'map_search'
+
+    id = Column(Integer, ForeignKey('map.id'), primary_key=True)
+    maptype = Column(String)
+    abbrev = Column(String)
+    book = Column(Integer)
+    page = Column(Integer)
+    npages = Column(Integer)
+    recdate = Column(Date)
+    client = Column(String)
+    description = Column(String)
+    surveyor_ids = Column(ARRAY(Integer))
+    fullnames = Column(ARRAY(String))
+    pls = Column(ARRAY(String))
+    rce = Column(ARRAY(String))
+    trs_paths = Column(ARRAY(LtreeType))
+
+    map = relationship('Map')
+
+    def __repr__(self):
+        return '<MapSearch(id=%d)>' % (self.id)
+
+
 if __name__ == '__main__':
 
     pass
@@ -0,0 +1,40 @@
+#
+# Rendered map list rows
+#
+# Every row of the map list is built from Map properties that format dates
+# and surveyor names in Python. A map's row only changes when the catalog
+# does so rows are rendered once from map-item.html and cached by catalog
+# generation and map id. A result page is then a join of cached rows and only
+# maps without a cached row are loaded from the database.
+#
+
+from markupsafe import Markup
+
+from hummaps import app
+from hummaps.cache import LRUCache
+from hummaps.catalog import generation
+from hummaps.search import load_maps
+
+
+row_cache = LRUCache(maxsize=app.config['MAP_ROW_CACHE_SIZE'])
+
+
+def row_key(gen, map_id):
+    return '%d:%d' % (gen, map_id)
+
+
+# Rendered rows for a list of map ids, in order
+def map_rows(ids):
+    gen = generation()
+    rows = {id: row_cache.get(row_key(gen, id)) for id in ids}
+
+    missing = [id for id, row in rows.items() if row is None]
+    if missing:
+        template = app.jinja_env.get_template('map-item.html')
+        map_url_base = app.config['MAP_URL_BASE']
+        for map in load_maps(missing):
+            row = Markup(template.render(map=map, map_url_base=map_url_base))
+            row_cache.set(row_key(gen, map.id), row)
+            rows[map.id] = row
+
+    return [rows[id] for id in ids if rows[id] is not None]
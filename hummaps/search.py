@@ -1,11 +1,24 @@
 import re
 from datetime import date
+from functools import lru_cache
+from hashlib import sha1
 import calendar
-from sqlalchemy import and_, or_, not_, between
-from sqlalchemy_utils import Ltree
+from sqlalchemy import and_, or_, not_, between, false, func, select, cast
+from sqlalchemy.dialects.postgresql import ARRAY, array
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy_utils import Ltree, LtreeType
 
+from hummaps import app
 from hummaps.database import db_session
-from hummaps.models import Map, MapImage, TRS, Source, MapType, Surveyor, CC, CCImage
+from hummaps.models import Map, MapImage, TRS, Source, MapType, Surveyor, CC, CCImage, MapSearch, signed_by
+from hummaps.trsindex import trs_index
+from hummaps.trigram import trigram_index
+from hummaps.surveyors import surveyor_index
+from hummaps.bitset import map_order
+from hummaps.catalog import generation
+from hummaps.cache import LRUCache
+from hummaps.trace import current_trace, trace_span
+from hummaps.guard import admit
 
 
 class ParseError(Exception):
@@ -121,11 +134,34 @@ def subsec_codes(subsec_str):
     return None
 
 
-def do_search(search):
-
-    # subqueries for the UNION/EXCEPT
-    subq_union = []
-    subq_except = []
+# A parsed search is a hashable, canonical tuple of union and except terms -
+#
+#   ((union_term, ...), (except_term, ...))
+#
+# Each term is a sorted tuple of (key, value) subterms. Subterms within a
+# term are ANDed (except MAP, PM and TR which are ORed) and terms are combined
+# with UNION and EXCEPT, so order doesn't matter and we sort and dedupe at
+# every level. Equivalent searches like 's36 2n 5e' and 'S36 T2N,R5E' parse
+# to the same tuple which serves as a key for any downstream caching.
+#
+# Subterm values -
+#
+#   BY      (field, pattern) where field is NAME, PLS, RCE or LICENSE
+#   DATE    (start, end) iso dates or () for maps with no recording date
+#   FOR     regex or '' for maps with no client
+#   DESC    regex or '' for maps with no description
+#   ANY     regex
+#   TYPE    regex
+#   ID      map id
+#   MAP     (book, maptype abbrev, page)
+#   PM, TR  parcel or tract map number (PM165, TR95)
+#   TRS     ('T.R', ((sec, subsec codes or ''), ...))
+#
+@lru_cache(maxsize=app.config['PARSE_CACHE_SIZE'])
+def parse_search(search):
+
+    terms_union = set()
+    terms_except = set()
 
     # split into multiple independent union/exclude search terms
     for prefix, term in re.findall('([+-])?([^+-]+)', search):
@@ -213,9 +249,8 @@ def do_search(search):
         if term:
             subterms.append([term, 'ANY', re.sub('\s+', '.*', term)])
 
-        # lists of 'OR' and 'AND' elements
-        or_terms = []
-        and_terms = []
+        # canonical (key, value) subterms
+        parsed = set()
 
         # keys and search terms
         # for terms that will be eventually processed by a postgresql regular expression
@@ -230,57 +265,41 @@ def do_search(search):
                     type, number = m.groups()
                     if type is None:
                         # pattern search both pls and rce
-                        and_terms.append(or_(Surveyor.pls.op('~*')(v), Surveyor.rce.op('~*')(v)))
+                        parsed.add(('BY', ('LICENSE', v)))
                     elif type.upper()[-2:] == 'LS':
-                        and_terms.append(Surveyor.pls.op('~*')(number))
+                        parsed.add(('BY', ('PLS', number)))
                     else:
-                        and_terms.append(Surveyor.rce.op('~*')(number))
+                        parsed.add(('BY', ('RCE', number)))
                 elif v == '':
-                    and_terms.append(Surveyor.fullname == None)
+                    parsed.add(('BY', ('NAME', '')))
                 else:
                     # replace spaces with wildcards and pattern search fullname
                     if v.strip().find(' ') < 0:
                         # pattern search full name
-                        and_terms.append(Surveyor.fullname.op('~*')(v))
+                        parsed.add(('BY', ('NAME', v)))
                     else:
                         # assume each non-space fragment starts a word
                         # add wildcards and word boundary qualifiers
-                        vqual = '\m' + re.sub('\s+', '.*\m', v)
-                        and_terms.append(Surveyor.fullname.op('~*')(vqual))
+                        vqual = '\m' + re.sub('\s+', r'.*\\m', v)
+                        parsed.add(('BY', ('NAME', vqual)))
             elif k == 'DATE' or k == 'REC':
                 if v == '':
-                    and_terms.append(Map.recdate == None)
-                else:
-                    dates = parse_dates(v)
-                    and_terms.append(between(Map.recdate, *dates))
-            elif k == 'FOR':
-                if v == '':
-                    and_terms.append(Map.client == None)
-                else:
-                    try: re.compile(v)
-                    except: raise ParseError(v, term)
-                    and_terms.append(Map.client.op('~*')(v))
-            elif k == 'DESC':
-                if v == '':
-                    and_terms.append(Map.description == None)
+                    parsed.add(('DATE', ()))
                 else:
+                    parsed.add(('DATE', parse_dates(v)))
+            elif k == 'FOR' or k == 'DESC':
+                if v != '':
                     try: re.compile(v)
                     except: raise ParseError(v, term)
-                    and_terms.append(Map.description.op('~*')(v))
-            elif k == 'ANY':
-                try:
-                    re.compile(v)
-                except:
-                    raise ParseError(v, term)
-                and_terms.append(
-                    or_(Map.client.op('~*')(v), Map.description.op('~*')(v))
-                )
-            elif k == 'TYPE':
+                parsed.add((k, v))
+            elif k == 'ANY' or k == 'TYPE':
                 try: re.compile(v)
                 except: raise ParseError(v, term)
-                and_terms.append(MapType.abbrev.op('~*')(v))
+                parsed.add((k, v))
             elif k == 'ID':
-                and_terms.append(Map.id == v)
+                if not v.isdigit():
+                    raise ParseError(v, term)
+                parsed.add(('ID', int(v)))
             elif k == 'MAP':
                 book, maptype, page = v
                 maptype = maptype.upper()
@@ -288,58 +307,352 @@ def do_search(search):
                     maptype = 'RM'
                 elif maptype == 'S':
                     maptype = 'RS'
-                or_terms.append(
-                    and_(
-                        Map.book == int(book), MapType.abbrev == maptype,
-                        Map.page <= int(page), Map.page + Map.npages > int(page))
-                )
-            elif k == 'PM':
-                or_terms.append(Map.client.op('~*')('\(%s\)(\s\w+)*$' % v))
-            elif k == 'TR':
-                or_terms.append(Map.client.op('~*')('\(%s\)(\s\w+)*$' % v))
+                parsed.add(('MAP', (int(book), maptype, int(page))))
+            elif k == 'PM' or k == 'TR':
+                parsed.add((k, v.upper()))
             elif k == 'TRS':
                 tshp = (v['tshp'] + '.' + v['rng']).upper()
-                if len(v['secs']) == 0:
-                    and_terms.append(TRS.trs_path.op('<@')(Ltree(tshp)))
-                else:
-                    sec_terms = []
-                    subsec_paths = []
-                    for sec in v['secs']:
-                        path = tshp + '.' + sec['sec']
-                        if sec['subsec'] is None:
-                            sec_terms.append(TRS.trs_path.op('<@')(Ltree(path)))
-                        else:
-                            for code in sec['subsec']:
-                                subsec_paths.append(Ltree(path + '.' + code))
-                    sec_terms.append(TRS.trs_path.in_(subsec_paths))
-                    and_terms.append(or_(*sec_terms))
-
-        if and_terms:
-            or_terms.append(and_(*and_terms))
-        if or_terms:
-            q = db_session.query(Map.id).join(MapType).outerjoin(TRS)
-            q = q.outerjoin(Surveyor, Map.surveyor)
-            q = q.filter(or_(*or_terms))
+                # merge subsections by section, a full section search includes all subsections
+                secs = {}
+                for sec in v['secs']:
+                    if sec['subsec'] is None or secs.get(sec['sec'], None) == '':
+                        secs[sec['sec']] = ''
+                    else:
+                        secs[sec['sec']] = ''.join(sorted(set(secs.get(sec['sec'], '') + sec['subsec'])))
+                parsed.add(('TRS', (tshp, tuple(sorted(secs.items())))))
+
+        if parsed:
             if prefix == '-':
-                subq_except.append(q)
+                terms_except.add(tuple(sorted(parsed)))
+            else:
+                terms_union.add(tuple(sorted(parsed)))
+
+    return (tuple(sorted(terms_union)), tuple(sorted(terms_except)))
+
+
+# Case-insensitive regex match of map client and/or description. With the
+# trigram index enabled the regex is only applied to candidate maps.
+def _regex_term(fields, pattern, model=Map):
+    term = or_(*[getattr(model, field).op('~*')(pattern) for field in fields])
+    if app.config['TRIGRAM_INDEX']:
+        ids = trigram_index.candidates(fields, pattern)
+        if ids is not None and len(ids) <= app.config['TRIGRAM_MAX_CANDIDATES']:
+            return and_(model.id.in_(ids), term) if ids else false()
+    return term
+
+
+# BY subterm for maps without a surveyor
+_NO_SURVEYOR = Surveyor.fullname == None
+
+
+# Surveyor predicate for the BY subterms of a term. All BY subterms must
+# match the same surveyor so they're combined into a single surveyor query
+# matched against the search table's surveyor id array. A NAME '' subterm
+# matches maps with no surveyors, same as the outer join of the map table.
+def _signed_by(by_terms):
+    surveyors = select([Surveyor.id]).where(and_(*by_terms)).as_scalar()
+    term = MapSearch.surveyor_ids.op('&&')(func.array(surveyors))
+    if all(t is _NO_SURVEYOR for t in by_terms):
+        term = or_(func.cardinality(MapSearch.surveyor_ids) == 0, term)
+    return term
+
+
+# Map ids for a single union/except term. Returns a frozenset of map ids
+# when the term resolves entirely from an index, otherwise a query of map ids.
+# With SEARCH_TABLE enabled the query filters the flattened map_search table.
+def _term_ids(term):
+
+    flat = app.config['SEARCH_TABLE']
+    M = MapSearch if flat else Map
+    abbrev = MapSearch.abbrev if flat else MapType.abbrev
+
+    # lists of 'OR' and 'AND' elements
+    or_terms = []
+    and_terms = []
+    by_terms = []
+
+    # surveyor ids matching every BY subterm resolved from the surveyor index
+    by_ids = None
+
+    for k, v in term:
+        if k == 'BY':
+            field, pattern = v
+            ids = surveyor_index.resolve(field, pattern) if app.config['SURVEYOR_INDEX'] and pattern else None
+            if ids is not None:
+                by_ids = ids if by_ids is None else by_ids & ids
+            elif field == 'LICENSE':
+                by_terms.append(or_(Surveyor.pls.op('~*')(pattern), Surveyor.rce.op('~*')(pattern)))
+            elif field == 'PLS':
+                by_terms.append(Surveyor.pls.op('~*')(pattern))
+            elif field == 'RCE':
+                by_terms.append(Surveyor.rce.op('~*')(pattern))
+            elif pattern == '':
+                by_terms.append(_NO_SURVEYOR)
+            else:
+                by_terms.append(Surveyor.fullname.op('~*')(pattern))
+        elif k == 'DATE':
+            if v:
+                and_terms.append(between(M.recdate, *v))
+            else:
+                and_terms.append(M.recdate == None)
+        elif k == 'FOR':
+            if v:
+                and_terms.append(_regex_term(('client',), v, M))
             else:
-                subq_union.append(q)
+                and_terms.append(M.client == None)
+        elif k == 'DESC':
+            if v:
+                and_terms.append(_regex_term(('description',), v, M))
+            else:
+                and_terms.append(M.description == None)
+        elif k == 'ANY':
+            and_terms.append(_regex_term(('client', 'description'), v, M))
+        elif k == 'TYPE':
+            and_terms.append(abbrev.op('~*')(v))
+        elif k == 'ID':
+            and_terms.append(M.id == v)
+        elif k == 'MAP':
+            book, maptype, page = v
+            or_terms.append(
+                and_(
+                    M.book == book, abbrev == maptype,
+                    M.page <= page, M.page + M.npages > page)
+            )
+        elif k == 'PM' or k == 'TR':
+            or_terms.append(_regex_term(('client',), '\(%s\)(\s\w+)*$' % v, M))
+        elif k == 'TRS':
+            tshp, secs = v
+            if app.config['TRS_INDEX']:
+                trs_ids = trs_index.lookup(tshp, secs)
+                if len(term) == 1:
+                    # the entire term resolves to a set of map ids
+                    return trs_ids
+                elif trs_ids:
+                    and_terms.append(M.id.in_(trs_ids))
+                else:
+                    and_terms.append(false())
+            elif flat:
+                sec_terms = []
+                subsec_paths = []
+                for sec, subsec in (secs or (('', ''),)):
+                    path = tshp + '.' + sec if sec else tshp
+                    if not subsec:
+                        # ltree[] <@ ltree is true if any path is a descendant
+                        sec_terms.append(MapSearch.trs_paths.op('<@')(cast(Ltree(path), LtreeType)))
+                    else:
+                        for code in subsec:
+                            subsec_paths.append(Ltree(path + '.' + code))
+                if subsec_paths:
+                    sec_terms.append(MapSearch.trs_paths.op('&&')(
+                        cast(array(subsec_paths, type_=LtreeType), ARRAY(LtreeType))))
+                and_terms.append(or_(*sec_terms))
+            elif len(secs) == 0:
+                and_terms.append(TRS.trs_path.op('<@')(Ltree(tshp)))
+            else:
+                sec_terms = []
+                subsec_paths = []
+                for sec, subsec in secs:
+                    path = tshp + '.' + sec
+                    if not subsec:
+                        sec_terms.append(TRS.trs_path.op('<@')(Ltree(path)))
+                    else:
+                        for code in subsec:
+                            subsec_paths.append(Ltree(path + '.' + code))
+                sec_terms.append(TRS.trs_path.in_(subsec_paths))
+                and_terms.append(or_(*sec_terms))
+
+    if by_ids is not None and not by_ids and not or_terms:
+        # no surveyor matches, skip the map query
+        return frozenset()
+
+    if by_terms:
+        if by_ids is not None:
+            by_terms.append(Surveyor.id.in_(by_ids))
+        if flat:
+            and_terms.append(_signed_by(by_terms))
+        else:
+            and_terms.extend(by_terms)
+    elif by_ids is not None:
+        if not by_ids:
+            and_terms.append(false())
+        elif flat:
+            and_terms.append(MapSearch.surveyor_ids.op('&&')(array(sorted(by_ids))))
+        else:
+            and_terms.append(signed_by.c.surveyor_id.in_(by_ids))
+
+    if and_terms:
+        or_terms.append(and_(*and_terms))
+
+    if flat:
+        return db_session.query(MapSearch.id).filter(or_(*or_terms))
+
+    q = db_session.query(Map.id).join(MapType).outerjoin(TRS)
+    if by_terms or by_ids is not None:
+        q = q.outerjoin(signed_by, signed_by.c.map_id == Map.id)
+    if by_terms:
+        q = q.outerjoin(Surveyor, Surveyor.id == signed_by.c.surveyor_id)
+
+    return q.filter(or_(*or_terms))
+
+
+# Ordered map ids for parsed search terms using SQL UNION/EXCEPT.
+def _search_ids(terms):
+
+    terms_union, terms_except = terms
+
+    # subqueries for the UNION/EXCEPT
+    subq_union = []
+    subq_except = []
 
-    if subq_union:
-        query = db_session.query(Map).join(MapType).outerjoin(TRS)
-        query = query.outerjoin(Surveyor, Map.surveyor)
+    # map ids for union/except terms resolved without a query
+    ids_union = set()
+    ids_except = set()
+
+    for terms, subq, ids in ((terms_union, subq_union, ids_union), (terms_except, subq_except, ids_except)):
+        for term in terms:
+            q = _term_ids(term)
+            if isinstance(q, frozenset):
+                ids.update(q)
+            else:
+                subq.append(q)
+
+    if subq_union or (ids_union and subq_except):
+        # combine index results with the subqueries
+        if ids_union:
+            subq_union.append(db_session.query(Map.id).filter(Map.id.in_(ids_union)))
+        if ids_except:
+            subq_except.append(db_session.query(Map.id).filter(Map.id.in_(ids_except)))
         subq = subq_union.pop(0)
         for q in subq_union:
             subq = subq.union(q)
         for q in subq_except:
             subq = subq.except_(q)
+    elif ids_union - ids_except:
+        # all terms resolved from the index
+        subq = ids_union - ids_except
+    else:
+        return ()
+
+    if app.config['SEARCH_TABLE']:
+        query = db_session.query(MapSearch.id).filter(MapSearch.id.in_(subq))
+        query = query.order_by(
+            MapSearch.maptype, MapSearch.recdate.desc(), MapSearch.book.desc(), MapSearch.page.desc())
+    else:
+        query = db_session.query(Map.id).join(MapType)
         query = query.filter(Map.id.in_(subq))
         query = query.order_by(MapType.maptype, Map.recdate.desc(), Map.book.desc(), Map.page.desc())
 
-        return query.all()
-    else:
+    return tuple(id for id, in query)
+
+
+# Ordered map ids for parsed search terms using bitset set algebra.
+# Each term is resolved to a set of map ids on its own.
+def _search_ids_bitset(terms):
+
+    terms_union, terms_except = terms
+
+    def term_bitset(term):
+        with trace_span('term_' + '_'.join(term_kinds(term)).lower()):
+            ids = _term_ids(term)
+            if not isinstance(ids, frozenset):
+                ids = (id for id, in ids)
+            return map_order.bitset(ids)
+
+    bits = map_order.empty()
+    for term in terms_union:
+        bits |= term_bitset(term)
+    if bits.any():
+        for term in terms_except:
+            bits &= ~term_bitset(term)
+
+    return map_order.ordered(bits)
+
+
+# Subterm kinds in a term (TRS, BY, DESC, MAP, ...)
+def term_kinds(term):
+    return sorted(set(k for k, v in term))
+
+
+# Default in-process search result cache
+result_cache = LRUCache(maxsize=app.config['SEARCH_RESULT_CACHE_SIZE'])
+
+
+# Result cache key for parsed search terms in a catalog generation.
+def search_key(terms, gen):
+    return '%d:%s' % (gen, sha1(repr(terms).encode('utf-8')).hexdigest())
+
+
+# Ordered map ids for a search. Results are cached by the parsed search and the
+# catalog generation so a catalog update invalidates all previous results.
+def search_ids(search):
+    # traced requests parse the search in the view (see views.hummaps)
+    terms = parse_search(search.strip())
+    gen = generation()
+
+    cache = app.config['SEARCH_RESULT_CACHE'] or result_cache
+    key = search_key(terms, gen)
+    ids = cache.get(key)
+
+    trace = current_trace()
+    if trace is not None and trace.cached is None:
+        trace.cached = ids is not None
+        trace.terms = [
+            {'op': op, 'kinds': term_kinds(term)}
+            for op, t in zip(('union', 'except'), terms) for term in t
+        ]
+
+    if ids is None:
+        with trace_span('index'):
+            if app.config['TRS_INDEX']:
+                trs_index.update(gen)
+            if app.config['TRIGRAM_INDEX']:
+                trigram_index.update(gen)
+            if app.config['SURVEYOR_INDEX']:
+                surveyor_index.update(gen)
+        with trace_span('search'), admit(terms):
+            if app.config['SEARCH_EVALUATOR'] == 'bitset':
+                map_order.update(gen)
+                ids = _search_ids_bitset(terms)
+            else:
+                ids = _search_ids(terms)
+        cache.set(key, ids)
+
+    return ids
+
+
+# Number of maps found by a search.
+def count_search(search):
+    return len(search_ids(search))
+
+
+# Maps found by a search. Only the maps in the offset/limit page of
+# the ordered results are loaded from the database.
+def do_search(search, offset=0, limit=None):
+
+    ids = search_ids(search)
+    return load_maps(ids[offset:None if limit is None else offset + limit])
+
+
+# Load maps by id, returned in the order of the ids.
+def load_maps(ids):
+    if not ids:
         return []
 
+    # Load everything the result list renders in a fixed number of queries
+    query = db_session.query(Map).filter(Map.id.in_(ids))
+    query = query.options(
+        joinedload(Map.maptype),
+        selectinload(Map.surveyor),
+        selectinload(Map.mapimages),
+        selectinload(Map.scans),
+        selectinload(Map.pdf),
+        selectinload(Map.certs).selectinload(CC.ccimages)
+    )
+    with trace_span('load'):
+        maps = {m.id: m for m in query}
+
+    return [maps[id] for id in ids if id in maps]
+
 
 if __name__ == '__main__':
 
@@ -417,6 +730,50 @@ if __name__ == '__main__':
     assert subsec_codes('W/2 W/2') == 'AEIM'
     assert subsec_codes('1/1') == 'ABCDEFGHIJKLMNOP'
 
+    # equivalent searches parse to the same canonical terms
+    assert parse_search('s36 2n 5e') == parse_search('S36 T2N R5E') == parse_search('s36 t2n,r5e')
+    assert parse_search('s35 s36 2n 5e') == parse_search('s36, s35 t2n r5e')
+    assert parse_search('1/1 s36 2n 5e') == parse_search('ne/4 s36 nw/4 s36 s/2 s36 2n 5e')
+    assert parse_search('type:rm by:crivelli') == parse_search('by=crivelli type=rm')
+    assert parse_search('by:ls9153') == parse_search('by:pls9153')
+    assert parse_search('date:2015') == parse_search('rec:"1/2015 12/2015"')
+    assert parse_search('1n 5e + 2n 5e - s5 1n 5e') == parse_search('+2n 5e -s5 1n 5e +1n 5e')
+    assert parse_search('11rm5 69rs30') == parse_search('69s30 11m5')
+
+    # Rendering a result page should take the same number of statements
+    # regardless of the number of maps on the page (no lazy loads), one for
+    # the maps and one for each eager loaded relationship. The cc images
+    # query is skipped when none of the maps has a certificate. Searches run
+    # first so index builds and the search queries aren't counted.
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from flask import render_template
+    from hummaps.rows import map_rows, row_cache
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    counts = {}
+    for srch in ('id:15833', '11rm5 69rs30 69rs11 34rs58', 's36 t2n r5e', '1/1 s32 t7n r1e'):
+        ids = search_ids(srch)
+        with app.test_request_context('/hummaps?q=' + srch):
+            row_cache.clear()
+            statements.clear()
+            event.listen(Engine, 'before_cursor_execute', count_statement)
+            rows = map_rows(ids)
+            render_template('hummaps.html', map_url_base='', query=srch, results=rows, total=len(rows))
+            event.remove(Engine, 'before_cursor_execute', count_statement)
+            print('\'%s\': %d maps, %d statements' % (srch, len(rows), len(statements)))
+            certs = any(m.certs for m in load_maps(ids))
+            assert len(statements) == (7 if certs else 6)
+            counts[len(rows)] = len(statements)
+
+    # a single map and a page of maps were both checked
+    assert 1 in counts and len(counts) > 1
+
     exit(0)
 
     # for m in db_session.query(Map).join(Surveyor, Map.surveyor).filter(Surveyor.fullname.op('~*')('crivelli')):
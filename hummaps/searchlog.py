@@ -0,0 +1,131 @@
+#
+# Structured search log
+#
+# Each map list search is written as a JSON line to SEARCH_LOG_FILE -
+#
+#   {"ts": "2026-10-17T15:47:55Z", "addr": "47.208.65.229", "query": "32 T6N R1E",
+#    "canonical": [...], "error": null, "count": 177, "msec": 41.2}
+#
+# canonical is the parsed search (see parse_search) or null if the search
+# didn't parse. Records are put on a queue and written by a background
+# thread to size rotated files so request threads never wait on the disk.
+#
+# 'flask search-report' summarizes the log files into top searches, slowest
+# searches, searches with no maps and the most common errors.
+#
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from hummaps import app
+
+
+logger = logging.getLogger('hummaps.searchlog')
+logger.propagate = False
+
+_listener = None
+_lock = threading.Lock()
+
+
+# Start the background writer on first use. uwsgi forks workers after the
+# app is imported so the thread has to be started in the worker.
+def _start():
+    global _listener
+    with _lock:
+        if _listener is None:
+            filename = app.config['SEARCH_LOG_FILE']
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            handler = RotatingFileHandler(
+                filename, maxBytes=app.config['SEARCH_LOG_MAX_BYTES'],
+                backupCount=app.config['SEARCH_LOG_BACKUP_COUNT'], encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            q = queue.Queue(-1)
+            logger.handlers = [QueueHandler(q)]
+            logger.setLevel(logging.INFO)
+            _listener = QueueListener(q, handler)
+            _listener.start()
+            atexit.register(_stop)
+
+
+# Flush queued records and stop the background writer
+def _stop():
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def log_search(addr, query, canonical, error, count, msec):
+    if not app.config['SEARCH_LOG_FILE']:
+        return
+    if _listener is None:
+        _start()
+    logger.info(json.dumps({
+        'ts': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'addr': addr,
+        'query': query,
+        'canonical': canonical,
+        'error': error,
+        'count': count,
+        'msec': round(msec, 1),
+    }))
+
+
+# Log files oldest first, the current file and its rotated backups
+def log_files(filename=None):
+    filename = filename or app.config['SEARCH_LOG_FILE']
+    files = ['%s.%d' % (filename, i) for i in range(app.config['SEARCH_LOG_BACKUP_COUNT'], 0, -1)]
+    return [f for f in files + [filename] if os.path.exists(f)]
+
+
+def read_records(files):
+    for filename in files:
+        with open(filename, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+# Summarize search records. Searches are grouped by canonical form and
+# shown by their most common raw query.
+def search_report(records, top=20):
+    counts = Counter()
+    raw = defaultdict(Counter)
+    zero = Counter()
+    errors = Counter()
+    slowest = []
+    total = 0
+
+    for r in records:
+        total += 1
+        if r['error']:
+            errors[r['error']] += 1
+            continue
+        key = json.dumps(r['canonical'])
+        counts[key] += 1
+        raw[key][r['query'].strip()] += 1
+        if r['count'] == 0:
+            zero[key] += 1
+        slowest.append((r['msec'], r['query'], r['count']))
+
+    def query(key):
+        return raw[key].most_common(1)[0][0]
+
+    slowest.sort(reverse=True)
+    return {
+        'total': total,
+        'top': [(query(k), n) for k, n in counts.most_common(top)],
+        'slowest': slowest[:top],
+        'zero': [(query(k), n) for k, n in zero.most_common(top)],
+        'errors': errors.most_common(top),
+    }
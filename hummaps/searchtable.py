@@ -0,0 +1,79 @@
+#
+# Flattened search table
+#
+# Searches normally run against a join of map, maptype, trs_path, signed_by
+# and surveyor which produces a row per map for every trs path and surveyor.
+# The map_search table (docs/map-search.sql) holds one row per map with the
+# maptype, surveyors and trs paths collapsed into arrays. With SEARCH_TABLE
+# enabled do_search filters this one table using its GIN/GiST indexes.
+#
+# The table is refreshed with 'flask refresh-search-table'. Rows are upserted
+# only when they differ from the catalog and rows for deleted maps removed, so
+# a refresh after recording a few new maps touches only those rows.
+#
+
+from sqlalchemy import text
+
+from hummaps import app
+from hummaps.database import db_session
+
+
+COLUMNS = (
+    'maptype', 'abbrev', 'book', 'page', 'npages', 'recdate', 'client', 'description',
+    'surveyor_ids', 'fullnames', 'pls', 'rce', 'trs_paths'
+)
+
+UPSERT_SQL = '''
+INSERT INTO {schema}map_search AS s (id, {columns})
+SELECT m.id, t.maptype, t.abbrev, m.book, m.page, m.npages, m.recdate, m.client, m.description,
+    coalesce(sv.ids, '{{}}'), coalesce(sv.fullnames, '{{}}'), coalesce(sv.pls, '{{}}'),
+    coalesce(sv.rce, '{{}}'), coalesce(tp.paths, '{{}}')
+FROM {schema}map m
+JOIN {schema}maptype t ON t.id = m.maptype_id
+LEFT JOIN LATERAL (
+    SELECT array_agg(v.id ORDER BY v.id) AS ids,
+        array_agg(v.fullname ORDER BY v.id) AS fullnames,
+        array_agg(v.pls ORDER BY v.id) AS pls,
+        array_agg(v.rce ORDER BY v.id) AS rce
+    FROM {schema}signed_by b
+    JOIN {schema}surveyor v ON v.id = b.surveyor_id
+    WHERE b.map_id = m.id
+) sv ON true
+LEFT JOIN LATERAL (
+    SELECT array_agg(p.trs_path ORDER BY p.trs_path) AS paths
+    FROM {schema}trs_path p
+    WHERE p.map_id = m.id AND p.trs_path IS NOT NULL
+) tp ON true
+ON CONFLICT (id) DO UPDATE SET {updates}
+WHERE ({current}) IS DISTINCT FROM ({excluded})
+'''
+
+DELETE_SQL = '''
+DELETE FROM {schema}map_search s
+WHERE NOT EXISTS (SELECT 1 FROM {schema}map m WHERE m.id = s.id)
+'''
+
+
+def _format(sql):
+    schema = app.config['DATABASE_TABLE_ARGS'].get('schema', None)
+    return sql.format(
+        schema=schema + '.' if schema else '',
+        columns=', '.join(COLUMNS),
+        updates=', '.join('%s = EXCLUDED.%s' % (c, c) for c in COLUMNS),
+        current=', '.join('s.' + c for c in COLUMNS),
+        excluded=', '.join('EXCLUDED.' + c for c in COLUMNS)
+    )
+
+
+# Bring the search table up to date with the catalog.
+# Returns the number of rows upserted and deleted.
+def refresh_search_table():
+    try:
+        upserted = db_session.execute(text(_format(UPSERT_SQL))).rowcount
+        deleted = db_session.execute(text(_format(DELETE_SQL))).rowcount
+        db_session.commit()
+    except:
+        db_session.rollback()
+        raise
+
+    return upserted, deleted
@@ -1,9 +1,9 @@
 
-$('.alert').on('close.bs.alert', function (e) {
+// Hide alerts rather than letting bootstrap remove them so they can be shown again
+$('.alert').on('click', 'button.close', function (e) {
   e.preventDefault();
-  $(this).css('display', 'none')
+  $(this).closest('.alert').css('display', 'none');
   console.log('alert: dismiss');
-  return true;
 })
 
 $('#fileupload').fileupload({
@@ -43,6 +43,11 @@ $('#fileupload').fileupload({
       filename = match[1].replace(/['"]/g, '');
     }
   }
+  var warning = xhr.getResponseHeader('X-Conversion-Warning');
+  if (warning) {
+    $('.alert-warning').css('display', 'block').find('span').last().text(warning);
+  }
+
   var type = xhr.getResponseHeader('Content-Type');
   var blob = new Blob([xhr.responseText], {type: type});
   var URL = window.URL || window.webkitURL;
@@ -127,9 +127,9 @@ $('#input-surveyor')
     .one('input', function(e) {
       // Lazy initialization of the surveyor typeahead.
       var input = $(this);
-      // Form's action attrib points to the form processing endpoint.
-      var ep = $('#search-dialog form').attr('action');
-      $.get(ep, { req: 'surveyors' }, function(data) {
+      // Versioned url of the surveyor list from the input's data-source attrib.
+      var ep = input.data('source');
+      $.get(ep, function(data) {
         // console.log('init surveyor typeahead: ' + data.length + ' items');
         input.typeahead({
           source: data,
@@ -0,0 +1,111 @@
+#
+# In-process surveyor index for BY search terms
+#
+# BY terms are POSIX regular expressions matched with ~* against surveyor
+# fullname, pls and rce. Inside the map join the regex runs once for every
+# joined row. The surveyor table is small and changes only when new maps are
+# recorded so we hold it in memory and resolve BY terms to sets of surveyor
+# ids with Python's re module. Maps are then filtered by signed_by.surveyor_id.
+#
+# Postgres word boundary escapes are translated to their Python equivalents
+# and escapes that mean the same in both are kept. Patterns using anything
+# else (POSIX bracket classes, other ARE escapes such as \b, which is a
+# backspace in Postgres) return None and stay in SQL.
+#
+
+import re
+
+from hummaps.database import db_session
+from hummaps.models import Surveyor
+
+
+# Postgres ARE escapes and their Python equivalents
+ARE_ESCAPES = {
+    'm': r'\b(?=\w)',       # beginning of a word
+    'M': r'\b(?<=\w)',      # end of a word
+    'y': r'\b',             # beginning or end of a word
+    'Y': r'\B',             # not the beginning or end of a word
+}
+
+# Escapes that mean the same in Postgres AREs and Python, along with any
+# escaped character that isn't a letter or digit
+SAME_ESCAPES = frozenset('dDsSwWAZntrfv')
+
+# Fields searched for each BY field
+SURVEYOR_FIELDS = {
+    'NAME': ('fullname',),
+    'PLS': ('pls',),
+    'RCE': ('rce',),
+    'LICENSE': ('pls', 'rce'),
+}
+
+
+# Compile a Postgres case-insensitive regex as a Python regex.
+# Returns None if the regex can't be translated.
+def translate(pattern):
+    if pattern.startswith('***') or pattern.startswith('(?') or '[[' in pattern:
+        return None
+    escapes = re.findall(r'\\(.)', pattern, flags=re.S)
+    if any(c not in ARE_ESCAPES and c not in SAME_ESCAPES and c.isalnum() for c in escapes):
+        return None
+    pattern = re.sub(r'\\(.)', lambda m: ARE_ESCAPES.get(m.group(1), m.group(0)), pattern, flags=re.S)
+    try:
+        return re.compile(pattern, flags=re.I)
+    except re.error:
+        return None
+
+
+class SurveyorIndex(object):
+
+    def __init__(self):
+        # tuple of (id, fullname, pls, rce)
+        self._surveyors = None
+        self.generation = None
+
+    @property
+    def loaded(self):
+        return self._surveyors is not None
+
+    def refresh(self, generation=None):
+        q = db_session.query(Surveyor.id, Surveyor.fullname, Surveyor.pls, Surveyor.rce)
+        self._surveyors = tuple(q.all())
+        self.generation = generation
+
+    # Reload the surveyors if loaded for a different catalog generation.
+    def update(self, generation):
+        if self._surveyors is None or self.generation != generation:
+            self.refresh(generation)
+
+    # Resolve a BY field and regex to a frozenset of surveyor ids.
+    # Returns None if the regex can't be evaluated in Python.
+    def resolve(self, field, pattern):
+        regex = translate(pattern)
+        if regex is None:
+            return None
+
+        if self._surveyors is None:
+            self.refresh()
+
+        cols = [('fullname', 'pls', 'rce').index(f) + 1 for f in SURVEYOR_FIELDS[field]]
+        return frozenset(
+            s[0] for s in self._surveyors
+            if any(s[c] is not None and regex.search(s[c]) for c in cols)
+        )
+
+
+surveyor_index = SurveyorIndex()
+
+
+if __name__ == '__main__':
+
+    assert translate(r'\mjohn.*\msmith').pattern == r'\b(?=\w)john.*\b(?=\w)smith'
+    assert translate(r'smith\M').search('Smith Jr')
+    assert not translate(r'smith\M').search('Smithers')
+    assert translate(r'\\m').pattern == r'\\m'
+    assert translate('crivelli|pulley').search('JOHN PULLEY')
+    assert translate('[[:alpha:]]+') is None
+    assert translate('(?i)smith') is None
+    assert translate(r'\bsmith') is None
+    assert translate(r'\x41') is None
+    assert translate(r'\1') is None
+    assert translate(r'j\.\s+smith\d*').search('J. SMITH')
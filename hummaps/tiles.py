@@ -0,0 +1,210 @@
+#
+# Deep zoom tile pyramids for map images
+#
+# Map images are scanned at full resolution and the viewer downloads the whole
+# image before anything is legible. This builds a Deep Zoom (DZI) tile pyramid
+# and a small preview image for every MapImage so a viewer can show the preview
+# right away and fetch only the tiles in view.
+#
+# For a map image /map/<path>.jpg the outputs under TILE_ROOT_DIR are -
+#
+#   <path>.dzi                      Deep Zoom descriptor
+#   <path>_files/<level>/<c>_<r>.jpg    tiles, level 0 is 1x1 pixels
+#   <path>_preview.jpg              preview TILE_PREVIEW_WIDTH pixels wide
+#
+# Builds are incremental. The manifest records each source image's mtime,
+# size and sha1. Images with an unchanged mtime and size are skipped without
+# reading them, images with a new mtime but the same hash just have their
+# manifest entry updated. Images are tiled in a process pool.
+#
+# Run with the flask command -
+#
+#   FLASK_APP=hummaps flask build-tiles [--workers N] [--force]
+#
+# Requires Pillow.
+#
+
+import json
+import math
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from hashlib import sha1
+
+from hummaps import app
+from hummaps.database import db_session
+from hummaps.models import MapImage
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def file_hash(filename):
+    h = sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+# Source file for a MapImage imagefile (/map/...). Map image urls are
+# relative to the parent of MAP_IMAGE_ROOT_DIR.
+def source_file(imagefile):
+    return os.path.join(os.path.dirname(app.config['MAP_IMAGE_ROOT_DIR']), imagefile.lstrip('/'))
+
+
+# Output path for a MapImage imagefile without the extension
+def tile_base(imagefile):
+    return os.path.join(app.config['TILE_ROOT_DIR'], os.path.splitext(imagefile.lstrip('/'))[0])
+
+
+def dzi_xml(width, height, tile_size, overlap, fmt):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+        'TileSize="%d" Overlap="%d" Format="%s">'
+        '<Size Width="%d" Height="%d"/></Image>\n' % (tile_size, overlap, fmt, width, height)
+    )
+
+
+# Build the pyramid and preview for one image. Runs in a worker process.
+# Tiles are written to a temporary directory and swapped into place so
+# viewers never see a partial pyramid.
+def build_pyramid(src, base, tile_size=256, overlap=1, quality=85, preview_width=400):
+    Image.MAX_IMAGE_PIXELS = None
+
+    img = Image.open(src)
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    width, height = img.size
+    fmt = 'jpg'
+
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    files_dir = base + '_files'
+    tmp_dir = files_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    max_level = int(math.ceil(math.log2(max(width, height, 1))))
+    level_img = img
+    for level in range(max_level, -1, -1):
+        scale = 2 ** (max_level - level)
+        w, h = max(int(math.ceil(width / scale)), 1), max(int(math.ceil(height / scale)), 1)
+        if level_img.size != (w, h):
+            # each level is a half size copy of the level above
+            level_img = level_img.resize((w, h), Image.LANCZOS)
+
+        level_dir = os.path.join(tmp_dir, str(level))
+        os.makedirs(level_dir)
+        for col in range(int(math.ceil(w / tile_size))):
+            for row in range(int(math.ceil(h / tile_size))):
+                x0 = max(col * tile_size - overlap, 0)
+                y0 = max(row * tile_size - overlap, 0)
+                x1 = min((col + 1) * tile_size + overlap, w)
+                y1 = min((row + 1) * tile_size + overlap, h)
+                tile = level_img.crop((x0, y0, x1, y1))
+                tile.save(os.path.join(level_dir, '%d_%d.%s' % (col, row, fmt)), 'JPEG', quality=quality)
+
+    shutil.rmtree(files_dir, ignore_errors=True)
+    os.replace(tmp_dir, files_dir)
+    with open(base + '.dzi', 'w') as f:
+        f.write(dzi_xml(width, height, tile_size, overlap, fmt))
+
+    preview = img.copy()
+    preview.thumbnail((preview_width, preview_width * height // max(width, 1) + 1), Image.LANCZOS)
+    preview.save(base + '_preview.jpg', 'JPEG', quality=quality)
+
+    return width, height
+
+
+def _build(imagefile, src, base, digest, params):
+    try:
+        build_pyramid(src, base, **params)
+    except Exception as e:
+        return imagefile, digest, '%s: %s' % (type(e).__name__, e)
+    return imagefile, digest, None
+
+
+def read_manifest(root):
+    try:
+        with open(os.path.join(root, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(root, manifest):
+    filename = os.path.join(root, MANIFEST_FILE)
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, filename)
+
+
+# Build tile pyramids for all map images that are new or changed since the
+# last build. Returns (built, skipped, errors) where errors is a list of
+# (imagefile, message).
+def build_tiles(workers=None, force=False, echo=print):
+    if Image is None:
+        raise RuntimeError('Pillow is required to build map tiles')
+
+    root = app.config['TILE_ROOT_DIR']
+    os.makedirs(root, exist_ok=True)
+    manifest = read_manifest(root)
+    params = {
+        'tile_size': app.config['TILE_SIZE'],
+        'overlap': app.config['TILE_OVERLAP'],
+        'quality': app.config['TILE_QUALITY'],
+        'preview_width': app.config['TILE_PREVIEW_WIDTH'],
+    }
+
+    # work out what needs building in this process, hashing only on mtime changes
+    jobs = []
+    skipped = 0
+    errors = []
+    imagefiles = sorted(set(f for f, in db_session.query(MapImage.imagefile) if f))
+    for imagefile in imagefiles:
+        src = source_file(imagefile)
+        try:
+            st = os.stat(src)
+        except OSError as e:
+            errors.append((imagefile, str(e)))
+            continue
+        entry = manifest.get(imagefile)
+        stamp = {'mtime': st.st_mtime, 'size': st.st_size}
+        if not force and entry and entry['params'] == params:
+            if entry['mtime'] == stamp['mtime'] and entry['size'] == stamp['size']:
+                skipped += 1
+                continue
+            digest = file_hash(src)
+            if entry['sha1'] == digest:
+                entry.update(stamp)
+                skipped += 1
+                continue
+        else:
+            digest = file_hash(src)
+        jobs.append((imagefile, src, tile_base(imagefile), digest, stamp))
+
+    built = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_build, f, src, base, digest, params): stamp
+                   for f, src, base, digest, stamp in jobs}
+        for future in as_completed(futures):
+            imagefile, digest, err = future.result()
+            if err:
+                errors.append((imagefile, err))
+                echo('%s: %s' % (imagefile, err))
+                continue
+            manifest[imagefile] = dict(futures[future], sha1=digest, params=params)
+            built += 1
+            if built % 100 == 0:
+                write_manifest(root, manifest)
+                echo('%d of %d images' % (built, len(jobs)))
+
+    write_manifest(root, manifest)
+
+    return built, skipped, errors
@@ -0,0 +1,118 @@
+#
+# Per-request search trace
+#
+# A sampled fraction of /hummaps requests (SEARCH_TRACE_RATE) record where
+# the time went: parsing, evaluating each union/except term, loading the page
+# of maps and rendering the template. Every SQL statement is recorded with the
+# span it ran in, its round trip time and row count. The finished trace is
+# logged as a JSON line to the 'hummaps.search' logger and, with
+# SEARCH_TRACE_SERVER_TIMING enabled, summarized in a Server-Timing header.
+#
+
+import json
+import logging
+import random
+from contextlib import contextmanager
+from time import perf_counter
+
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from hummaps import app
+
+
+logger = logging.getLogger('hummaps.search')
+
+
+class SearchTrace(object):
+
+    def __init__(self, query=''):
+        self.query = query
+        self.start = perf_counter()
+        self.spans = []             # (name, msec)
+        self.terms = []             # {op, kinds} for each union/except term
+        self.statements = []        # dict(span, sql, msec, rows)
+        self.cached = None
+        self._span = None
+
+    # Time a block of work. Statements executed in the block are tagged
+    # with the span name. Spans don't nest, the innermost name is used.
+    @contextmanager
+    def span(self, name):
+        outer = self._span
+        self._span = name
+        t0 = perf_counter()
+        try:
+            yield self
+        finally:
+            self.spans.append((name, (perf_counter() - t0) * 1000))
+            self._span = outer
+
+    def statement(self, sql, msec, rows):
+        self.statements.append({'span': self._span, 'sql': sql, 'msec': round(msec, 3), 'rows': rows})
+
+    def as_dict(self):
+        return {
+            'query': self.query,
+            'msec': round((perf_counter() - self.start) * 1000, 3),
+            'cached': self.cached,
+            'terms': self.terms,
+            'spans': [{'name': n, 'msec': round(t, 3)} for n, t in self.spans],
+            'db_msec': round(sum(s['msec'] for s in self.statements), 3),
+            'statements': self.statements,
+        }
+
+    # Server-Timing header value, one metric per span plus the database total
+    def server_timing(self):
+        metrics = ['%s;dur=%.1f' % (n, t) for n, t in self.spans]
+        metrics.append('db;dur=%.1f;desc="%d queries"' % (
+            sum(s['msec'] for s in self.statements), len(self.statements)))
+        return ', '.join(metrics)
+
+
+# Start a trace for the current request if it's sampled.
+def start_trace(query):
+    rate = app.config['SEARCH_TRACE_RATE']
+    if rate and random.random() < rate:
+        g.search_trace = SearchTrace(query)
+        return g.search_trace
+    return None
+
+
+# Trace for the current request or None
+def current_trace():
+    return g.get('search_trace', None) if has_app_context() else None
+
+
+# Time a block of work if the request is traced.
+@contextmanager
+def trace_span(name):
+    trace = current_trace()
+    if trace is None:
+        yield None
+    else:
+        with trace.span(name):
+            yield trace
+
+
+# Log the trace and add the Server-Timing header.
+def finish_trace(trace, resp):
+    logger.info(json.dumps(trace.as_dict()))
+    if app.config['SEARCH_TRACE_SERVER_TIMING']:
+        resp.headers['Server-Timing'] = trace.server_timing()
+    return resp
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_trace() is not None:
+        conn.info.setdefault('trace_start', []).append(perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = current_trace()
+    if trace is not None and conn.info.get('trace_start'):
+        msec = (perf_counter() - conn.info['trace_start'].pop()) * 1000
+        trace.statement(statement, msec, cursor.rowcount)
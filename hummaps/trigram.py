@@ -0,0 +1,214 @@
+#
+# In-process trigram index for regex searches of map client and description
+#
+# FOR, DESC, ANY (bare word), PM and TR terms are POSIX regular expressions
+# matched with ~* against map.client and map.description which forces a
+# sequential scan of the map table. Most of these regexes contain literal
+# strings that any match must include. Any text containing a literal also
+# contains all of the literal's trigrams so intersecting trigram posting
+# lists gives a small set of candidate maps. The exact regex is still applied
+# by the database, only to the candidates, so search semantics don't change.
+#
+# Deployments with the pg_trgm extension can use GIN trigram indexes instead
+# (docs/trigram-index.sql) and turn this off with TRIGRAM_INDEX = False.
+#
+
+import re
+from array import array
+from collections import defaultdict
+
+from hummaps.database import db_session
+from hummaps.models import Map
+
+
+# Fields indexed for each search key
+TRIGRAM_FIELDS = ('client', 'description')
+
+# Escapes that consume more than one character (hex, unicode, octal,
+# control and back references). We don't try to interpret these.
+MULTI_CHAR_ESCAPES = 'xuUc0123456789'
+
+# A bound {m}, {m,} or {m,n}
+BOUND_PAT = re.compile('\{\d+(,\d*)?\}')
+
+
+def trigrams(s):
+    return set(s[i:i + 3] for i in range(len(s) - 2))
+
+
+# Extract literal strings that must appear in any text matched by a regex.
+# Returns a list of lower case literals or None if the regex is beyond our
+# simple analysis. Only runs of ascii letters, digits and spaces outside of
+# groups are considered. Anything made optional by a quantifier, anything
+# in a group and anything after a top level alternation is dropped so the
+# result is always safe to use as a prefilter.
+def required_literals(pattern):
+
+    # ARE directors and embedded options change how the regex is read
+    if pattern.startswith('***') or pattern.startswith('(?'):
+        return None
+
+    literals = []
+    run = ''
+    depth = 0
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+
+        if c == '\\':
+            if i + 1 >= n or pattern[i + 1] in MULTI_CHAR_ESCAPES:
+                return None
+            literals.append(run)
+            run = ''
+            i += 2
+
+        elif c == '[':
+            # skip the bracket expression
+            literals.append(run)
+            run = ''
+            i += 1
+            if i < n and pattern[i] == '^':
+                i += 1
+            if i < n and pattern[i] == ']':
+                i += 1
+            while i < n and pattern[i] != ']':
+                if pattern[i] == '\\':
+                    i += 2
+                elif pattern[i] == '[' and i + 1 < n and pattern[i + 1] in ':.=':
+                    j = pattern.find(pattern[i + 1] + ']', i + 2)
+                    if j < 0:
+                        return None
+                    i = j + 2
+                else:
+                    i += 1
+            if i >= n:
+                return None
+            i += 1
+
+        elif c in '?*':
+            # previous character is optional
+            literals.append(run[:-1])
+            run = ''
+            i += 1
+
+        elif c == '{':
+            m = BOUND_PAT.match(pattern, i)
+            literals.append(run[:-1] if m else run)
+            run = ''
+            i = m.end() if m else i + 1
+
+        elif c == '|':
+            if depth == 0:
+                return None
+            i += 1
+
+        elif c == '(':
+            literals.append(run)
+            run = ''
+            depth += 1
+            i += 1
+
+        elif c == ')':
+            depth -= 1
+            i += 1
+
+        elif depth == 0 and c.isascii() and (c.isalnum() or c == ' '):
+            run += c.lower()
+            i += 1
+
+        else:
+            literals.append(run)
+            run = ''
+            i += 1
+
+    literals.append(run)
+
+    return [s for s in literals if s]
+
+
+class TrigramIndex(object):
+
+    def __init__(self):
+        # field -> trigram -> sorted array of map ids
+        self._postings = None
+        self.generation = None
+
+    @property
+    def loaded(self):
+        return self._postings is not None
+
+    def refresh(self, generation=None):
+        postings = {field: defaultdict(set) for field in TRIGRAM_FIELDS}
+
+        columns = [getattr(Map, field) for field in TRIGRAM_FIELDS]
+        q = db_session.query(Map.id, *columns)
+        for row in q.yield_per(10000):
+            for field, text in zip(TRIGRAM_FIELDS, row[1:]):
+                if text:
+                    for t in trigrams(text.lower()):
+                        postings[field][t].add(row[0])
+
+        self._postings = {
+            field: {t: array('i', sorted(ids)) for t, ids in p.items()}
+            for field, p in postings.items()
+        }
+        self.generation = generation
+
+    # Rebuild the index if it was built for a different catalog generation.
+    def update(self, generation):
+        if self._postings is None or self.generation != generation:
+            self.refresh(generation)
+
+    # Candidate map ids for a regex matched against one or more fields.
+    # Returns None if no useful prefilter can be derived from the regex.
+    def candidates(self, fields, pattern):
+        literals = required_literals(pattern)
+        if literals is None:
+            return None
+        grams = set()
+        for s in literals:
+            grams.update(trigrams(s))
+        if not grams:
+            return None
+
+        if self._postings is None:
+            self.refresh()
+
+        ids = set()
+        for field in fields:
+            postings = self._postings[field]
+            lists = sorted((postings.get(t, ()) for t in grams), key=len)
+            if not lists[0]:
+                continue
+            found = set(lists[0])
+            for p in lists[1:]:
+                found.intersection_update(p)
+                if not found:
+                    break
+            ids.update(found)
+
+        return ids
+
+
+trigram_index = TrigramIndex()
+
+
+if __name__ == '__main__':
+
+    assert required_literals('deerfield.*ranch') == ['deerfield', 'ranch']
+    assert required_literals('patrick.{1,3}point') == ['patrick', 'point']
+    assert required_literals('Mad River') == ['mad river']
+    assert required_literals('colou?r') == ['colo', 'r']
+    assert required_literals('ab+c') == ['ab', 'c']
+    assert required_literals('\(PM165\)(\s\w+)*$') == ['pm165']
+    assert required_literals('lot [0-9]+ of tract') == ['lot ', ' of tract']
+    assert required_literals('[[:alpha:]]road') == ['road']
+    assert required_literals('(north|south) fork') == [' fork']
+    assert required_literals('crivelli|pulley') is None
+    assert required_literals('\d{5}') == []
+    assert required_literals('\\x41bc') is None
+    assert required_literals('[\\]abc]road') == ['road']
+    assert required_literals('(?i)road') is None
+    assert required_literals('[abc') is None
+    assert required_literals('"') == []
@@ -0,0 +1,137 @@
+#
+# In-process township/range/section index
+#
+# TRS search terms normally become ltree predicates against trs_path joined
+# through the map table. The TRS table changes only when new maps are recorded
+# so we can hold the whole thing in memory and resolve TRS terms to sets of
+# map ids without touching the database.
+#
+# Index layout -
+#
+#   township.range -> section -> subsection mask -> sorted map ids
+#
+# trs_path labels are township, range, section and subsection (2N.5E.36.K).
+# Subsections A-P are bits 0-15 of the mask. A map's mask in a section is the
+# union of all its subsection records for that section. Maps indexed only to
+# the section (the original Hollins records) have a mask of zero.
+#
+
+from collections import defaultdict
+
+from hummaps.database import db_session
+from hummaps.models import TRS
+
+
+# Subsection letter to mask bit
+SUBSEC_BITS = {c: 1 << i for i, c in enumerate('ABCDEFGHIJKLMNOP')}
+
+
+def subsec_mask(codes):
+    mask = 0
+    for c in codes:
+        mask |= SUBSEC_BITS[c]
+    return mask
+
+
+class TRSIndex(object):
+
+    def __init__(self):
+        # (index, townships, sections) where -
+        #   index: tr -> sec -> mask -> sorted ids
+        #   townships: tr -> frozenset of ids
+        #   sections: (tr, sec) -> frozenset of ids
+        self._data = None
+        self.generation = None
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    # Build the index from the trs_path table. The new index is swapped
+    # in whole so concurrent lookups see either the old or the new version.
+    def refresh(self, generation=None):
+        masks = defaultdict(lambda: defaultdict(int))     # (tr, sec) -> map_id -> mask
+
+        q = db_session.query(TRS.map_id, TRS.trs_path).filter(TRS.trs_path != None)
+        for map_id, trs_path in q.yield_per(10000):
+            labels = trs_path.path.split('.')
+            if len(labels) < 2:
+                continue
+            tr = labels[0] + '.' + labels[1]
+            sec = labels[2] if len(labels) > 2 else None
+            bit = SUBSEC_BITS.get(labels[3], 0) if len(labels) > 3 else 0
+            masks[(tr, sec)][map_id] |= bit
+
+        index = defaultdict(dict)
+        townships = defaultdict(set)
+        sections = {}
+        for (tr, sec), maps in masks.items():
+            by_mask = defaultdict(list)
+            for map_id, mask in maps.items():
+                by_mask[mask].append(map_id)
+            index[tr][sec] = {mask: tuple(sorted(ids)) for mask, ids in by_mask.items()}
+            sections[(tr, sec)] = frozenset(maps)
+            townships[tr].update(maps)
+
+        townships = {tr: frozenset(ids) for tr, ids in townships.items()}
+        self._data = (dict(index), townships, sections)
+        self.generation = generation
+
+    # Rebuild the index if it was built for a different catalog generation.
+    def update(self, generation):
+        if self._data is None or self.generation != generation:
+            self.refresh(generation)
+
+    # Resolve a township/range and list of sections to a set of map ids.
+    # Mirrors the ltree search -
+    #
+    #   no sections: trs_path <@ 'tr'
+    #   section without subsections: trs_path <@ 'tr.sec'
+    #   section with subsections: trs_path IN ('tr.sec.A', 'tr.sec.B', ...)
+    #
+    # tr is 'T.R' (2N.5E) and secs is a list of (sec, subsec) where subsec
+    # is a string of subsection codes or None.
+    def lookup(self, tr, secs=()):
+        if self._data is None:
+            self.refresh()
+        index, townships, sections = self._data
+
+        if not secs:
+            return townships.get(tr, frozenset())
+
+        ids = set()
+        for sec, subsec in secs:
+            if not subsec:
+                ids.update(sections.get((tr, sec), ()))
+                continue
+            q = subsec_mask(subsec)
+            for mask, map_ids in index.get(tr, {}).get(sec, {}).items():
+                if mask & q:
+                    ids.update(map_ids)
+
+        return frozenset(ids)
+
+
+trs_index = TRSIndex()
+
+
+if __name__ == '__main__':
+
+    from time import perf_counter
+
+    t0 = perf_counter()
+    trs_index.refresh()
+    print('refresh: %.3f sec' % (perf_counter() - t0))
+
+    for tr, secs, n in (
+        ('1N.5E', (), 129),
+        ('2N.5E', (('36', None),), 26),
+        ('2N.5E', (('25', None), ('26', None), ('35', None), ('36', None)), 31),
+        ('2N.5E', (('36', 'ABCDEFGHIJKLMNOP'),), 5),
+        ('2N.5E', (('36', 'KLOP'),), 3),
+        ('7N.1E', (('32', 'ABCDEFGHIJKLMNOP'),), 249),
+    ):
+        t0 = perf_counter()
+        ids = trs_index.lookup(tr, secs)
+        print('%s %s: %d (%.1f usec)' % (tr, secs, len(ids), (perf_counter() - t0) * 1E6))
+        assert len(ids) == n
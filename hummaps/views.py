@@ -1,18 +1,66 @@
-from flask import request, make_response, send_from_directory
-from flask import render_template, flash
+from flask import request, make_response
+from flask import Response, stream_with_context
+from flask import render_template, flash, redirect, url_for, abort
 from flask.json import jsonify, dumps
 
 from hummaps import app
-from hummaps.xhr import xhr_request
-from hummaps.search import do_search, ParseError
+from hummaps.xhr import xhr_request, surveyor_list
+from hummaps.search import search_ids, count_search, ParseError
+from hummaps.search import parse_search
+from hummaps.guard import SearchRejected
+from hummaps.catalog import generation
+from hummaps.trace import start_trace, finish_trace, trace_span
+from hummaps.api import search_lines, read_cursor, CursorError
+from hummaps.files import send_map_file
+from hummaps.derivatives import scan_derivatives
+from hummaps.assets import asset_manifest
+from hummaps.rows import map_rows
+from hummaps.searchlog import log_search
 
 from hummaps.gpx import gpx_in, gpx_out
 from hummaps.gpx import pnezd_in, pnezd_out
+from hummaps.gpx import grid_limits_warning
 
 from hummaps.polycalc import process_line_data
 
 import os.path
-from time import time
+from concurrent import futures
+from hashlib import sha1
+from time import time, perf_counter
+
+
+# Templates last modified, part of every ETag with the asset manifest version
+# so cached pages don't outlive a deploy
+TEMPLATE_VERSION = max(
+    os.path.getmtime(f.path) for f in os.scandir(os.path.join(app.root_path, app.template_folder))
+)
+
+
+# Strong ETag for a response that depends only on the given values
+def make_etag(*values):
+    key = repr(values + (TEMPLATE_VERSION, asset_manifest.version))
+    return sha1(key.encode('utf-8')).hexdigest()
+
+
+# Canonical form of a search, raises ParseError. The raw query is kept
+# since it's echoed in the search box.
+def q_key(q):
+    return parse_search(q.strip()), q
+
+
+# Empty 304 response if the request's If-None-Match has the ETag otherwise None
+def not_modified(etag):
+    if request.if_none_match.contains(etag):
+        resp = make_response('', 304)
+        resp.set_etag(etag)
+        return resp
+    return None
+
+
+# Versioned url of the surveyor list for the current catalog generation
+@app.template_global()
+def surveyors_url():
+    return url_for('surveyors_json', gen=generation())
 
 
 # Custom filter for the Jinja2 template processor
@@ -33,13 +81,58 @@ def index():
 # Map image files.
 @app.route('/hummaps/map/<path:path>', methods=['GET'])
 def send_map_image(path):
-    return send_from_directory(app.config['MAP_IMAGE_ROOT_DIR'], path)
+    return send_map_file(app.config['MAP_IMAGE_ROOT_DIR'], path, app.config['MAP_IMAGE_ACCEL_PREFIX'])
 
 
 # Map pdf files.
 @app.route('/hummaps/pdf/<path:path>', methods=['GET'])
 def send_map_pdf(path):
-    return send_from_directory(app.config['MAP_PDF_ROOT_DIR'], path)
+    return send_map_file(app.config['MAP_PDF_ROOT_DIR'], path, app.config['MAP_PDF_ACCEL_PREFIX'])
+
+
+# Map image tile pyramids and previews.
+@app.route('/hummaps/tiles/<path:path>', methods=['GET'])
+def send_map_tile(path):
+    return send_map_file(app.config['TILE_ROOT_DIR'], path, app.config['TILE_ACCEL_PREFIX'])
+
+
+# Web size derivatives of map scans.
+@app.route('/hummaps/derivative/<int:width>/<preset>/<path:path>', methods=['GET'])
+def send_scan_derivative(width, preset, path):
+    # futures.TimeoutError is an OSError from Python 3.11, catch it first
+    try:
+        name = scan_derivatives.derivative(path, width, preset)
+    except futures.TimeoutError:
+        resp = make_response(render_template('503.html'), 503)
+        resp.headers['Retry-After'] = '5'
+        return resp
+    except (ValueError, OSError):
+        abort(404)
+    except RuntimeError as err:
+        # Pillow isn't installed, derivatives are unavailable until it is
+        app.logger.error('Scan derivative %s: %s', path, err)
+        return render_template('503.html'), 503
+    return send_map_file(app.config['SCAN_DERIVATIVE_CACHE_DIR'], name, app.config['SCAN_DERIVATIVE_ACCEL_PREFIX'])
+
+
+# Surveyor list for the search popup. The url is versioned by catalog
+# generation so the response never changes and can be cached as immutable.
+@app.route('/hummaps/surveyors-<int:gen>.json', methods=['GET'])
+def surveyors_json(gen):
+    current = generation()
+    if gen != current:
+        return redirect(url_for('surveyors_json', gen=current))
+
+    surveyor_list.update(current)
+    encoding = request.accept_encodings.best_match(surveyor_list.encodings, default='identity')
+    resp = make_response(surveyor_list.encoded(encoding))
+    resp.mimetype = 'application/json'
+    if encoding != 'identity':
+        resp.headers['Content-Encoding'] = encoding
+    resp.vary.add('Accept-Encoding')
+    resp.set_etag(make_etag('surveyors', current, encoding))
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp
 
 
 # hummaps - the Humboldt County map index.
@@ -48,7 +141,17 @@ def hummaps():
 
     args = request.args
     if request.is_xhr:
-        resp = jsonify(xhr_request(args.get('req', '')))
+        req = args.get('req', '')
+        etag = make_etag('xhr', req, generation())
+        resp = not_modified(etag)
+        if resp is None:
+            if req == 'surveyors':
+                surveyor_list.update(generation())
+                resp = make_response(surveyor_list.encoded())
+                resp.mimetype = 'application/json'
+            else:
+                resp = jsonify(xhr_request(req))
+            resp.set_etag(etag)
         resp.cache_control.public = True
         resp.cache_control.max_age = 3600
         resp.expires = int(time() + 3600)
@@ -58,9 +161,41 @@ def hummaps():
     else:
         form = None
 
+    # Page through the results
+    page_size = app.config['SEARCH_PAGE_SIZE']
+    try:
+        page = max(int(args.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    offset = (page - 1) * page_size
+
     q = args.get('q', '')
+    trace = start_trace(q) if q else None
+
+    # Search pages change only with the query, page and catalog generation.
+    # Searches that don't parse get the error page without an ETag. This is
+    # where a GET search is first parsed so it's timed as the parse span.
+    etag = None
+    if form is None:
+        try:
+            with trace_span('parse'):
+                key = q_key(q)
+            etag = make_etag('search', key, page, generation())
+        except (ParseError, ValueError):
+            # bad dates raise ValueError, the search below reports it
+            pass
+        else:
+            resp = not_modified(etag)
+            if resp is not None:
+                if trace is not None:
+                    finish_trace(trace, resp)
+                return resp
+
     if q == '':
-        return render_template('hummaps.html', query='', results=[])
+        resp = make_response(render_template('hummaps.html', query='', results=[]))
+        if etag:
+            resp.set_etag(etag)
+        return resp
 
         # Server side processing of form data
         # if form:
@@ -88,22 +223,82 @@ def hummaps():
         #     if form['maps']:
         #         q = ' '.join([q, form['maps']])
 
+    t0 = perf_counter()
+
     results = []
+    total = 0
+    canonical = None
+    error = None
     try:
-        results = do_search(q)
+        if form is None:
+            # parsed and traced with the ETag above
+            canonical = parse_search(q.strip())
+        else:
+            with trace_span('parse'):
+                canonical = parse_search(q.strip())
+        total = count_search(q)
+        if offset >= total > 0:
+            # past the last page, show the last page
+            page = (total + page_size - 1) // page_size
+            offset = (page - 1) * page_size
+        with trace_span('rows'):
+            results = map_rows(search_ids(q)[offset:offset + page_size])
     except ParseError as e:
         term = ' (%s)' % e.term if e.term else ''
         flash('Search error%s: <strong>%s</strong>' % (term, e.err), 'error')
+        etag = None
+        error = 'ParseError: %s' % e
     except Exception as e:
         flash('Search error: <strong>%s</strong>' % str(e), 'error')
-
-    total = len(results)
-    if total > 200:
-        results = results[0:200]
+        etag = None
+        error = '%s: %s' % (type(e).__name__, e)
 
     map_url_base = app.config['MAP_URL_BASE']
 
-    return render_template('hummaps.html', map_url_base=map_url_base, query=q, form=form, results=results, total=total)
+    with trace_span('render'):
+        resp = make_response(render_template(
+            'hummaps.html', map_url_base=map_url_base, query=q, form=form,
+            results=results, total=total, page=page, offset=offset))
+
+    if etag:
+        resp.set_etag(etag)
+
+    log_search(request.remote_addr, q, canonical, error, total, (perf_counter() - t0) * 1000)
+
+    if trace is not None:
+        finish_trace(trace, resp)
+
+    return resp
+
+
+# Search results as newline delimited JSON, see api.py.
+@app.route('/hummaps/api/search', methods=['GET'])
+def search_api():
+    args = request.args
+    page_size = app.config['SEARCH_API_PAGE_SIZE']
+    try:
+        if 'cursor' in args:
+            q, offset, limit = read_cursor(args['cursor'])
+        else:
+            q, offset = args.get('q', ''), 0
+            limit = min(max(int(args.get('limit', page_size)), 1), page_size)
+        lines = search_lines(q, offset, limit)
+        # run the search before the response starts so errors get a status
+        first = next(lines)
+    except CursorError as err:
+        return (jsonify(error=str(err)), 410)
+    except (ParseError, ValueError) as err:
+        return (jsonify(error=str(err)), 400)
+    except SearchRejected as err:
+        resp = make_response(jsonify(error=str(err)), 503)
+        resp.headers['Retry-After'] = '5'
+        return resp
+
+    def generate():
+        yield first
+        yield from lines
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 
 # polycalc - generate DXF linework from a command file.
@@ -147,11 +342,12 @@ def gpx():
 
     try:
         pnts = []
+        skipped = []
         for f in request.files.getlist('file'):
             if f.filename.endswith('.txt'):
                 pnts += pnezd_in(f.stream, target_srid)
             elif f.filename.endswith('.gpx'):
-                pnts += gpx_in(f.stream, nad83=nad83)
+                pnts += gpx_in(f.stream, nad83=nad83, skipped=skipped)
             else:
                 raise TypeError('Unsupported file type: "%s"' % f.filename)
 
@@ -159,7 +355,7 @@ def gpx():
             resp = make_response(pnezd_out(pnts, target_srid))
             outfile += '.txt'
         elif datatype == 'gpx':
-            resp = make_response(gpx_out(pnts, nad83=nad83))
+            resp = make_response(gpx_out(pnts, nad83=nad83, skipped=skipped))
             outfile += '.gpx'
         else:
             raise TypeError('Bad request data type: "%s"' % datatype)
@@ -169,6 +365,10 @@ def gpx():
 
     resp.headers['Content-Disposition'] = 'attachment; filename="%s"' % outfile
     resp.mimetype = 'application/octet-stream'
+    if skipped:
+        # points that couldn't be converted, shown with the download link
+        warning = grid_limits_warning(skipped)
+        resp.headers['X-Conversion-Warning'] = warning.encode('ascii', 'replace').decode('ascii')
     resp.cache_control.no_cache = True
     resp.cache_control.no_store = True
     return resp
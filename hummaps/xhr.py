@@ -1,7 +1,14 @@
+import gzip
+import json
 
 from hummaps.database import db_session
 from hummaps.models import Surveyor
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 
 def xhr_request(req):
 
@@ -13,6 +20,48 @@ def xhr_request(req):
     return response
 
 
+# The surveyor list for the search popup serialized once per catalog
+# generation as json bytes with gzip and (if available) brotli variants.
+class SurveyorList(object):
+
+    def __init__(self):
+        # content encoding -> bytes
+        self._payload = None
+        self.generation = None
+
+    @property
+    def loaded(self):
+        return self._payload is not None
+
+    def refresh(self, generation=None):
+        data = json.dumps(xhr_request('surveyors'), separators=(',', ':')).encode('utf-8')
+        payload = {'identity': data, 'gzip': gzip.compress(data, 9)}
+        if brotli is not None:
+            payload['br'] = brotli.compress(data)
+        self._payload = payload
+        self.generation = generation
+
+    # Rebuild the payload if it was built for a different catalog generation.
+    def update(self, generation):
+        if self._payload is None or self.generation != generation:
+            self.refresh(generation)
+
+    # Content encodings available, preferred first
+    @property
+    def encodings(self):
+        if self._payload is None:
+            self.refresh()
+        return tuple(e for e in ('br', 'gzip', 'identity') if e in self._payload)
+
+    def encoded(self, encoding='identity'):
+        if self._payload is None:
+            self.refresh()
+        return self._payload[encoding]
+
+
+surveyor_list = SurveyorList()
+
+
 if __name__ == '__main__':
 
     from flask import Flask
@@ -23,3 +72,6 @@ if __name__ == '__main__':
         resp = xhr_request('surveyors')
         print('length: %d' % (len(resp)))
         print(resp)
+
+        for e in surveyor_list.encodings:
+            print('%s: %d bytes' % (e, len(surveyor_list.encoded(e))))